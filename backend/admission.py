@@ -0,0 +1,336 @@
+"""
+Admission control for expensive endpoints.
+
+``AdmissionMiddleware`` matches each request against a list of ``RouteLimit``
+rules by method and path prefix and applies, in order:
+
+1. a per-IP token bucket (429 with Retry-After when empty);
+2. a per-route concurrency limit with a short bounded queue (503 with
+   Retry-After when the queue is full or the wait times out).
+
+Per-company buckets need a verified identity, so they are charged later, by
+``charge_company`` from a route dependency that runs after authentication.
+
+Buckets live in process memory by default. With ``RATE_LIMIT_DB`` set they
+are kept in a SQLite file instead, so every worker on the host shares them.
+Either way a bucket is dropped once it has refilled to its burst, since a
+full bucket behaves exactly like a missing one.
+"""
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import orjson
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+registry.describe("eureka_admission_decisions_total", "counter", "Admission decisions by route rule, decision and limit")
+registry.describe("eureka_admission_waiting", "gauge", "Requests queued for a route concurrency slot")
+
+# How often (seconds) buckets that have refilled are purged, piggybacked on takes
+PURGE_INTERVAL = 60.0
+
+
+class RouteLimit:
+    """
+    Limits for requests whose path starts with ``prefix``.
+
+    ``ip_rate``/``company_rate`` are tokens per second with bursts of
+    ``ip_burst``/``company_burst``; a rate of 0 disables that bucket.
+    ``concurrency`` caps requests in the handler at once, with up to
+    ``max_queue`` more waiting at most ``queue_timeout`` seconds.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        prefix: str,
+        methods: Sequence[str] = ("POST",),
+        concurrency: int = 0,
+        max_queue: int = 0,
+        queue_timeout: float = 2.0,
+        ip_rate: float = 0.0,
+        ip_burst: float = 0.0,
+        company_rate: float = 0.0,
+        company_burst: float = 0.0,
+    ):
+        self.name = name
+        self.prefix = prefix
+        self.methods = set(methods)
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst or ip_rate
+        self.company_rate = company_rate
+        self.company_burst = company_burst or company_rate
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+
+    def matches(self, method: str, path: str) -> bool:
+        return method in self.methods and path.startswith(self.prefix)
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the server's event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+
+class MemoryBucketStore:
+    """Token buckets in process memory"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (tokens, updated, time the bucket will be full again)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._purged_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        """Take one token; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._purged_at > PURGE_INTERVAL:
+                self._purged_at = now
+                self._buckets = {k: bucket for k, bucket in self._buckets.items() if bucket[2] > now}
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+        return wait
+
+
+class SQLiteBucketStore:
+    """Token buckets in a SQLite file shared by the workers on one host"""
+
+    # take() may wait on the file lock, so callers run it off the event loop
+    blocking = True
+
+    def __init__(self, path: str, timeout: float = 0.05):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._purged_at = time.time()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        # Added after the table first shipped; existing rows count as due for purging
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(token_buckets)")}
+        if "full_at" not in columns:
+            conn.execute("ALTER TABLE token_buckets ADD COLUMN full_at REAL NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_token_buckets_full_at ON token_buckets(full_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        return conn
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM token_buckets").fetchone()[0]
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        # Wall clock, since monotonic clocks are not comparable across processes
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if now - self._purged_at > PURGE_INTERVAL:
+                self._purged_at = now
+                conn.execute("DELETE FROM token_buckets WHERE full_at <= ?", (now,))
+            row = conn.execute("SELECT tokens, updated FROM token_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(now - updated, 0) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute(
+                "INSERT OR REPLACE INTO token_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                (key, tokens, now, now + (burst - tokens) / rate),
+            )
+            conn.execute("COMMIT")
+            return wait
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def default_limits() -> List[RouteLimit]:
+    def env(name: str, default: float) -> float:
+        return float(os.getenv(name, default))
+
+    return [
+        RouteLimit(
+            "upload", "/upload",
+            concurrency=int(env("UPLOAD_CONCURRENCY", 8)), max_queue=int(env("UPLOAD_QUEUE", 32)), queue_timeout=5.0,
+            ip_rate=env("UPLOAD_IP_RATE", 5), ip_burst=env("UPLOAD_IP_BURST", 20),
+            company_rate=env("UPLOAD_COMPANY_RATE", 10), company_burst=env("UPLOAD_COMPANY_BURST", 50),
+        ),
+        # bcrypt work is already capped by the password service; these keep floods off it entirely
+        RouteLimit(
+            "login", "/login/",
+            concurrency=int(env("LOGIN_CONCURRENCY", 16)), max_queue=int(env("LOGIN_QUEUE", 64)),
+            ip_rate=env("LOGIN_IP_RATE", 1), ip_burst=env("LOGIN_IP_BURST", 10),
+        ),
+        RouteLimit(
+            "register", "/register/",
+            concurrency=int(env("REGISTER_CONCURRENCY", 4)), max_queue=int(env("REGISTER_QUEUE", 16)),
+            ip_rate=env("REGISTER_IP_RATE", 0.2), ip_burst=env("REGISTER_IP_BURST", 5),
+        ),
+        # Each call computes a pure-Python MinHash signature in the extraction pool
+        RouteLimit(
+            "verify_similar", "/verify/similar",
+            concurrency=int(env("VERIFY_SIMILAR_CONCURRENCY", 2)), max_queue=int(env("VERIFY_SIMILAR_QUEUE", 8)),
+            ip_rate=env("VERIFY_SIMILAR_IP_RATE", 1), ip_burst=env("VERIFY_SIMILAR_IP_BURST", 10),
+        ),
+    ]
+
+
+def default_store():
+    path = os.getenv("RATE_LIMIT_DB")
+    return SQLiteBucketStore(path) if path else MemoryBucketStore()
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying rate limits and concurrency limits from ``RouteLimit`` rules"""
+
+    def __init__(self, app, limits: Optional[List[RouteLimit]] = None, store=None, trust_forwarded: Optional[bool] = None):
+        self.app = app
+        self.limits = default_limits() if limits is None else limits
+        self.store = store or default_store()
+        if trust_forwarded is None:
+            trust_forwarded = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "").lower() in ("1", "true", "yes")
+        self.trust_forwarded = trust_forwarded
+
+    def _client_ip(self, scope) -> str:
+        if self.trust_forwarded:
+            forwarded = _header(scope, b"x-forwarded-for")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def _take(self, key: str, rate: float, burst: float) -> float:
+        try:
+            if getattr(self.store, "blocking", False):
+                return await run_in_threadpool(self.store.take, key, rate, burst)
+            return self.store.take(key, rate, burst)
+        except sqlite3.Error as e:
+            # A contended or broken shared store must not take the API down with it
+            logger.warning("Rate limit store unavailable, allowing request: %s", e, extra={"sample": 100})
+            registry.inc("eureka_errors_total", stage="admission.store")
+            return 0.0
+
+    @staticmethod
+    async def _reject(send, status_code: int, detail: str, retry_after: float) -> None:
+        body = orjson.dumps({"detail": detail})
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = next((rule for rule in self.limits if rule.matches(scope["method"], scope["path"])), None)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        if limit.ip_rate:
+            wait = await self._take(f"{limit.name}:ip:{self._client_ip(scope)}", limit.ip_rate, limit.ip_burst)
+            if wait:
+                registry.inc("eureka_admission_decisions_total", route=limit.name, decision="rate_limited", limit="ip")
+                await self._reject(send, 429, "Too many requests", wait)
+                return
+        # For charge_company once the route has authenticated the caller
+        scope["admission"] = (self, limit)
+
+        if not limit.concurrency:
+            registry.inc("eureka_admission_decisions_total", route=limit.name, decision="allowed", limit="none")
+            await self.app(scope, receive, send)
+            return
+
+        semaphore = limit.semaphore
+        if semaphore.locked():
+            if limit.waiting >= limit.max_queue:
+                registry.inc("eureka_admission_decisions_total", route=limit.name, decision="shed", limit="queue")
+                await self._reject(send, 503, "Server busy, try again shortly", limit.queue_timeout)
+                return
+            limit.waiting += 1
+            registry.add_gauge("eureka_admission_waiting", 1, route=limit.name)
+            try:
+                await asyncio.wait_for(semaphore.acquire(), limit.queue_timeout)
+            except asyncio.TimeoutError:
+                registry.inc("eureka_admission_decisions_total", route=limit.name, decision="shed", limit="timeout")
+                await self._reject(send, 503, "Server busy, try again shortly", limit.queue_timeout)
+                return
+            finally:
+                limit.waiting -= 1
+                registry.add_gauge("eureka_admission_waiting", -1, route=limit.name)
+            registry.inc("eureka_admission_decisions_total", route=limit.name, decision="queued", limit="concurrency")
+        else:
+            await semaphore.acquire()
+            registry.inc("eureka_admission_decisions_total", route=limit.name, decision="allowed", limit="concurrency")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            semaphore.release()
+
+
+async def charge_company(scope, company_id: Optional[str]) -> None:
+    """
+    Charge the per-company bucket of the rule that admitted this request,
+    raising 429 when it is empty. ``company_id`` must come from a verified
+    identity; a claim the client could forge would let it spend another
+    tenant's budget or dodge its own.
+    """
+    admitted = scope.get("admission")
+    if admitted is None or not company_id:
+        return
+    middleware, limit = admitted
+    if not limit.company_rate:
+        return
+    wait = await middleware._take(f"{limit.name}:company:{company_id}", limit.company_rate, limit.company_burst)
+    if wait:
+        registry.inc("eureka_admission_decisions_total", route=limit.name, decision="rate_limited", limit="company")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))}
+        )
@@ -1,9 +1,13 @@
 from jose import jwt
 import httpx
-from fastapi import Request, HTTPException, Depends
+from fastapi import Request, HTTPException, Depends, Header, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
+import hmac
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 SUPABASE_PROJECT_URL = "https://uxbxcgdlltyfpilmrkst.supabase.co"
 JWKS_URL = f"{SUPABASE_PROJECT_URL}/auth/v1/keys"
@@ -33,7 +37,7 @@ async def get_jwks():
                 res = await client.get(JWKS_URL, timeout=5.0)
                 if res.status_code != 200:
                     # If we can't get the JWKS, return an empty dict with keys
-                    print(f"Warning: Could not fetch JWKS. Status: {res.status_code}")
+                    logger.warning("Could not fetch JWKS. Status: %s", res.status_code)
                     return {"keys": []}
                 
                 jwks_data = res.json()
@@ -43,12 +47,29 @@ async def get_jwks():
                 jwks = jwks_data
         return jwks
     except Exception as e:
-        print(f"Error fetching JWKS: {e}")
+        logger.error("Error fetching JWKS: %s", e)
         return {"keys": []}
 
 security = HTTPBearer(auto_error=False)
 
 async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     # Always return the mock user to bypass authentication completely
-    print("Warning: Authentication disabled, using mock user")
+    # Logged on every request, so keep only a sample
+    logger.warning("Authentication disabled, using mock user", extra={"sample": 1000})
     return MOCK_USER
+
+# Shared secret for operational endpoints (profiling, status updates); unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+async def require_admin(x_admin_token: str = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin endpoints are disabled"
+        )
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid admin token"
+        )
+    return True
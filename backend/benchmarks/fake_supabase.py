@@ -0,0 +1,127 @@
+"""
+In-memory stand-in for the parts of the Supabase client the backend uses:
+``client.table(name).select/insert/update/delete().eq/in_/order/range(...).execute()``.
+
+Each ``execute()`` can sleep for a fixed latency to approximate the network
+round trip to a hosted project, since the real client is synchronous too.
+"""
+import itertools
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+
+class APIResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.operation = "select"
+        self.payload = None
+        self.upsert = False
+        self.filters = []
+        self.order_by = None
+        self.bounds = None
+
+    def select(self, columns="*"):
+        self.operation = "select"
+        return self
+
+    def insert(self, payload, upsert=False):
+        self.operation = "insert"
+        self.payload = payload
+        self.upsert = upsert
+        return self
+
+    def update(self, payload):
+        self.operation = "update"
+        self.payload = payload
+        return self
+
+    def delete(self):
+        self.operation = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, {str(value)}))
+        return self
+
+    def in_(self, column, values):
+        self.filters.append((column, {str(value) for value in values}))
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by = (column, desc)
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def _matches(self, row):
+        return all(str(row.get(column)) in values for column, values in self.filters)
+
+    def execute(self):
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        with self.client.lock:
+            rows = self.client.tables.setdefault(self.table, [])
+            if self.operation == "select":
+                selected = [dict(row) for row in rows if self._matches(row)]
+                if self.order_by:
+                    column, desc = self.order_by
+                    selected.sort(key=lambda row: str(row.get(column)), reverse=desc)
+                if self.bounds:
+                    selected = selected[self.bounds[0]:self.bounds[1] + 1]
+                return APIResponse(selected)
+            if self.operation == "insert":
+                payload = self.payload if isinstance(self.payload, list) else [self.payload]
+                inserted = [self.client.new_row(self.table, item) for item in payload]
+                if self.upsert:
+                    # Merge on the primary key, like Prefer: resolution=merge-duplicates
+                    replaced = {row["id"] for row in inserted}
+                    rows[:] = [row for row in rows if row["id"] not in replaced]
+                rows.extend(inserted)
+                return APIResponse([dict(row) for row in inserted])
+            if self.operation == "update":
+                updated = []
+                for row in rows:
+                    if self._matches(row):
+                        row.update(self.payload)
+                        updated.append(dict(row))
+                return APIResponse(updated)
+            kept = [row for row in rows if not self._matches(row)]
+            deleted = [dict(row) for row in rows if self._matches(row)]
+            self.client.tables[self.table] = kept
+            return APIResponse(deleted)
+
+
+class FakeSupabaseClient:
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000.0
+        self.tables = {}
+        self.lock = threading.Lock()
+        self._serial = itertools.count(1)
+
+    def new_row(self, table, item):
+        now = datetime.now(timezone.utc).isoformat()
+        row = dict(item)
+        if table == "login_log":
+            row.setdefault("id", next(self._serial))
+            row.setdefault("login_time", now)
+        else:
+            row.setdefault("id", str(uuid.uuid4()))
+            row.setdefault("created_at", now)
+            row.setdefault("updated_at", now)
+        return row
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        raise NotImplementedError("rpc is not supported by the fake client")
@@ -0,0 +1,432 @@
+"""
+Load-test the FastAPI app in-process against a fake Supabase.
+
+Usage (from the backend directory):
+
+    python benchmarks/run_benchmarks.py --output benchmarks/results/run.json
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/baseline.json
+
+The app is driven through httpx's ASGI transport, so numbers exclude the
+HTTP server and network but include middleware, validation and disk I/O.
+Every run works in a fresh temporary directory.
+
+The reported peak RSS is the process's high-water mark so far, so it only
+grows from one scenario to the next; run a scenario alone with ``--only``
+to see its own peak.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+from fake_supabase import FakeSupabaseClient
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+MOCK_USER_ID = "00000000-0000-0000-0000-000000000000"
+BENCH_PASSWORD = "benchmark-password"
+
+
+def parse_size(value: str) -> int:
+    units = {"KB": 1024, "MB": 1024 * 1024, "B": 1}
+    value = value.strip().upper()
+    for suffix, factor in units.items():
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * factor)
+    return int(value)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def peak_rss_kb() -> int:
+    """Peak resident set size over the whole process lifetime, not per scenario"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def boot_app(workdir: Path, latency_ms: float):
+    """Import main against the fake Supabase inside an isolated working directory"""
+    fake = FakeSupabaseClient(latency_ms=latency_ms)
+    fake_module = types.ModuleType("supabase")
+    fake_module.Client = FakeSupabaseClient
+    fake_module.create_client = lambda url, key: fake
+    sys.modules["supabase"] = fake_module
+
+    os.environ.setdefault("SUPABASE_URL", "http://fake-supabase.local")
+    os.environ.setdefault("SUPABASE_KEY", "fake-key")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # All benchmark traffic comes from one client address; measure handlers, not the rate limiter
+    for route in ("UPLOAD", "LOGIN", "REGISTER", "VERIFY_SIMILAR"):
+        os.environ.setdefault(f"{route}_IP_RATE", "0")
+        os.environ.setdefault(f"{route}_COMPANY_RATE", "0")
+
+    os.chdir(workdir)
+    os.symlink(BACKEND_DIR / "static", workdir / "static")
+    sys.path.insert(0, str(BACKEND_DIR))
+    import main
+    return main, fake
+
+
+async def drive(client, make_request, total: int, concurrency: int):
+    """Issue ``total`` requests with at most ``concurrency`` in flight"""
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, url, kwargs, expected = make_request(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code not in expected:
+                errors += 1
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - wall_start
+    return latencies, errors, wall
+
+
+def summarise(name, params, concurrency, latencies, errors, wall, py_peak):
+    ordered = sorted(latencies)
+    to_ms = 1000.0
+    return {
+        "scenario": name,
+        "params": params,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ordered, 0.50) * to_ms, 3),
+            "p95": round(percentile(ordered, 0.95) * to_ms, 3),
+            "p99": round(percentile(ordered, 0.99) * to_ms, 3),
+            "mean": round(sum(ordered) / len(ordered) * to_ms, 3) if ordered else 0.0,
+            "max": round(ordered[-1] * to_ms, 3) if ordered else 0.0,
+        },
+        "peak_rss_kb_cumulative": peak_rss_kb(),
+        "py_peak_kb": py_peak,
+    }
+
+
+def make_pdf(size: int, seed: str) -> bytes:
+    """A small invoice PDF padded with an incompressible stream to roughly ``size`` bytes"""
+    rng = random.Random(seed)
+    text = (
+        "BT /F1 10 Tf 50 750 Td (TAX INVOICE) Tj 0 -14 Td (Invoice Number: INV-%d) Tj "
+        "0 -14 Td (Account Name: Bench Supplies Ltd) Tj 0 -14 Td (Sort Code: 40-63-84) Tj "
+        "0 -14 Td (Account No: 89615010) Tj 0 -14 Td (Amount Due GBP %d.00) Tj ET"
+        % (rng.randrange(10000), rng.randrange(1, 5000))
+    ).encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 << /Type /Font /Subtype /Type1 /BaseFont /Helvetica >> >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(text) + text + b"\nendstream",
+    ]
+    padding = rng.randbytes(max(size - 1024, 0))
+    objects.append(b"<< /Length %d >>\nstream\n" % len(padding) + padding + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def seed_history(main, count: int) -> None:
+    """Replace the metadata file with ``count`` documents for the mock user"""
+    records = [
+        {
+            "id": f"INV-{i // 10000:04d}-{i % 10000:04d}",
+            "name": f"INV-{i // 10000:04d}-{i % 10000:04d}.pdf",
+            "original_filename": "Invoice.pdf",
+            "file_hash": uuid.UUID(int=i).hex * 2,
+            "file_path": "uploads/missing.pdf",
+            "user_id": MOCK_USER_ID,
+            "user_email": "mock@example.com",
+            "user_name": "Mock User",
+            "timestamp": datetime(2025, 1, 1).isoformat(),
+            "status": "active",
+            "size": "40.8 KB",
+            "version": 1,
+        }
+        for i in range(count)
+    ]
+    with open(main.DOCUMENTS_METADATA_FILE, "w") as f:
+        json.dump(records, f)
+    main.document_store = main.DocumentStore(main.DOCUMENTS_METADATA_FILE)
+
+
+def build_scenarios(main, fake, args):
+    """Yield (name, params, setup, make_request) tuples"""
+    company_id = str(uuid.uuid4())
+    fake.tables["companies"] = [fake.new_row("companies", {
+        "id": company_id, "name": "Bench Co", "email": "bench@company.com",
+        "password": main.password_service.context.hash(BENCH_PASSWORD), "registered_address": "1 Bench St",
+    })]
+    fake.tables["users"] = [fake.new_row("users", {
+        "full_name": "Bench User", "email": "login@example.com", "company_id": company_id,
+        "password_hash": main.password_service.context.hash(BENCH_PASSWORD),
+    })]
+
+    run_id = uuid.uuid4().hex[:8]
+
+    def register_request(i):
+        body = {
+            "full_name": "Bench User",
+            "email": f"user-{run_id}-{i}-{random.random():.8f}@example.com",
+            "company_id": company_id,
+            "password": BENCH_PASSWORD,
+        }
+        return "POST", "/register/user", {"json": body}, (200,)
+
+    def login_request(i):
+        body = {"email": "login@example.com", "password": BENCH_PASSWORD}
+        return "POST", "/login/user", {"json": body}, (200,)
+
+    yield "register_user", {}, None, register_request
+    yield "login_user", {}, None, login_request
+
+    for size_label in args.upload_sizes:
+        payload = make_pdf(parse_size(size_label), size_label)
+
+        def upload_request(i, payload=payload):
+            # A trailing comment makes every upload unique, so none is answered as a repeat
+            files = {"file": (f"bench-{i}.pdf", payload + b"%% bench-%d\n" % i, "application/pdf")}
+            return "POST", "/upload", {"files": files}, (200,)
+
+        def repeat_upload_request(i, payload=payload):
+            files = {"file": (f"bench-{i}.pdf", payload, "application/pdf")}
+            return "POST", "/upload", {"files": files}, (200,)
+
+        yield "upload", {"size": size_label}, lambda: seed_history(main, 0), upload_request
+        yield "upload_repeat", {"size": size_label}, lambda: seed_history(main, 0), repeat_upload_request
+
+    for history in args.history_sizes:
+        def documents_request(i):
+            return "GET", "/documents", {}, (200,)
+
+        def revalidate_request(i):
+            etag = main.document_store.user_etag(MOCK_USER_ID)
+            return "GET", "/documents", {"headers": {"If-None-Match": etag}}, (304,)
+
+        def document_request(i, history=history):
+            n = i % history
+            return "GET", f"/document/INV-{n // 10000:04d}-{n % 10000:04d}", {}, (200,)
+
+        setup = lambda history=history: seed_history(main, history)
+        yield "documents", {"history": history}, setup, documents_request
+        yield "documents_revalidate", {"history": history}, setup, revalidate_request
+        if history:
+            yield "document_by_id", {"history": history}, setup, document_request
+
+        def receipt_request(i, history=history):
+            n = i % history
+            return "GET", f"/document/INV-{n // 10000:04d}-{n % 10000:04d}/receipt", {}, (200,)
+
+        if history:
+            yield "document_receipt", {"history": history}, setup, receipt_request
+
+    def metrics_request(i):
+        return "GET", "/metrics", {}, (200,)
+
+    yield "metrics_scrape", {}, None, metrics_request
+
+
+def measure_metrics_overhead(iterations: int = 200000) -> dict:
+    """Cost of recording one stage and of rendering the registry"""
+    from metrics import registry, stage
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with stage("bench.noop"):
+            pass
+    stage_us = (time.perf_counter() - start) / iterations * 1e6
+
+    start = time.perf_counter()
+    for _ in range(100):
+        registry.render()
+    render_ms = (time.perf_counter() - start) / 100 * 1000
+    return {"stage_overhead_us": round(stage_us, 3), "render_ms": round(render_ms, 3)}
+
+
+def measure_receipt_verification(main, batch_sizes=(1, 100, 1000)) -> dict:
+    """Per-receipt cost of offline signature checks, with and without reusing key objects across a batch"""
+    from verify_receipt import ReceiptVerifier
+
+    jwks = main.receipt_signer.jwks()
+    tokens = [
+        main.receipt_signer.sign({
+            "id": f"INV-BNCH-{i:04d}", "file_hash": "0" * 64, "timestamp": datetime.now().isoformat(), "version": 1,
+        })[0]
+        for i in range(max(batch_sizes))
+    ]
+    results = {}
+    for size in batch_sizes:
+        start = time.perf_counter()
+        verifier = ReceiptVerifier(jwks)
+        for token in tokens[:size]:
+            verifier.claims(token)
+        batched_us = (time.perf_counter() - start) / size * 1e6
+
+        start = time.perf_counter()
+        for token in tokens[:size]:
+            ReceiptVerifier(jwks).claims(token)
+        naive_us = (time.perf_counter() - start) / size * 1e6
+        results[str(size)] = {"batched_us": round(batched_us, 1), "per_receipt_key_us": round(naive_us, 1)}
+    return results
+
+
+async def run(args):
+    workdir = Path(tempfile.mkdtemp(prefix="eureka-bench-"))
+    try:
+        main, fake = boot_app(workdir, args.supabase_latency_ms)
+        # ASGITransport doesn't send lifespan events; run startup so password
+        # calibration and the event stream task happen as they would in a server
+        await main.app.router.startup()
+        try:
+            results = []
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for name, params, setup, make_request in build_scenarios(main, fake, args):
+                    if args.only and name not in args.only:
+                        continue
+                    for concurrency in args.concurrency:
+                        if setup:
+                            setup()
+                        total = args.login_requests if name in ("login_user", "register_user") else args.requests
+                        if args.tracemalloc:
+                            tracemalloc.start()
+                        latencies, errors, wall = await drive(client, make_request, total, concurrency)
+                        py_peak = None
+                        if args.tracemalloc:
+                            py_peak = tracemalloc.get_traced_memory()[1] // 1024
+                            tracemalloc.stop()
+                        result = summarise(name, params, concurrency, latencies, errors, wall, py_peak)
+                        results.append(result)
+                        print(format_result(result))
+        finally:
+            await main.app.router.shutdown()
+        return {
+            "meta": {
+                "timestamp": datetime.now().isoformat(),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            },
+            "metrics_overhead": measure_metrics_overhead(),
+            "receipt_verification": measure_receipt_verification(main),
+            "results": results,
+        }
+    finally:
+        os.chdir(BACKEND_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_result(result) -> str:
+    params = ",".join(f"{k}={v}" for k, v in result["params"].items())
+    latency = result["latency_ms"]
+    return (
+        f"{result['scenario']:<22} {params:<16} c={result['concurrency']:<4} "
+        f"{result['throughput_rps']:>9.1f} rps  p50={latency['p50']:>8.2f}ms "
+        f"p95={latency['p95']:>8.2f}ms p99={latency['p99']:>8.2f}ms "
+        f"peak_rss_so_far={result['peak_rss_kb_cumulative'] // 1024}MB errors={result['errors']}"
+    )
+
+
+def result_key(result):
+    return result["scenario"], json.dumps(result["params"], sort_keys=True), result["concurrency"]
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> bool:
+    """Print p95/throughput deltas against a baseline run; return True on regression"""
+    previous = {result_key(r): r for r in baseline["results"]}
+    regressed = False
+    for result in current["results"]:
+        before = previous.get(result_key(result))
+        if not before:
+            continue
+        p95_change = (result["latency_ms"]["p95"] - before["latency_ms"]["p95"]) / max(before["latency_ms"]["p95"], 1e-9)
+        rps_change = (result["throughput_rps"] - before["throughput_rps"]) / max(before["throughput_rps"], 1e-9)
+        flag = ""
+        if p95_change > threshold or rps_change < -threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        scenario, params, concurrency = result_key(result)
+        print(f"{scenario:<22} {params:<22} c={concurrency:<4} p95 {p95_change:+.1%}  rps {rps_change:+.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Eureka backend benchmark suite")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario and concurrency level")
+    parser.add_argument("--login-requests", type=int, default=50, help="requests for bcrypt-bound scenarios")
+    parser.add_argument("--upload-sizes", nargs="+", default=["10KB", "1MB", "5MB"])
+    parser.add_argument("--history-sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--supabase-latency-ms", type=float, default=0.0)
+    parser.add_argument("--only", nargs="+", help="run only these scenarios")
+    parser.add_argument("--tracemalloc", action="store_true", help="track Python heap peaks (slows requests)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path, help="write results JSON here")
+    parser.add_argument("--compare", type=Path, help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if compare(baseline, report, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,533 @@
+"""
+Bulk import/export for onboarding customers.
+
+Streams CSV or NDJSON in and out of the document metadata store and the
+``companies``/``users`` tables in batches. Table batches are single
+multi-row PostgREST inserts, or COPY through a staging table when
+DATABASE_URL is set and psycopg2 is installed; either way accounts whose
+email is already present are skipped, and rows that fail are written to
+``<input>.errors.ndjson`` without stopping the import. Batches run on a pool of
+workers and are committed in input order, so an interrupted import resumes
+from its checkpoint. Document imports copy and hash the referenced files in
+the workers and append each batch to the metadata store in one write.
+
+    python bulk.py export documents documents.ndjson --user-id <uuid>
+    python bulk.py export users users.csv
+    python bulk.py import companies companies.csv --workers 4
+    python bulk.py import documents invoices.ndjson --files-dir /mnt/customer/pdfs
+"""
+import argparse
+import csv
+import hashlib
+import io
+import itertools
+import os
+import threading
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional
+
+import orjson
+
+from config import UPLOAD_DIR, human_size, new_document_id, open_document_store
+
+try:
+    import psycopg2  # COPY fast path, used only when DATABASE_URL is set
+except ImportError:
+    psycopg2 = None
+
+TABLES = ("companies", "users")
+DEFAULT_BATCH_SIZE = 500
+CHUNK_SIZE = 1024 * 1024
+# Columns holding password hashes; plaintext values found there are hashed on import
+PASSWORD_COLUMNS = {"companies": "password", "users": "password_hash"}
+# Unique column identifying an account across exports and replays; rows are
+# skipped, not merged, when an account with the same key already exists
+NATURAL_KEYS = {"companies": "email", "users": "email"}
+# Per-record fields that describe where a copy lives, not the document itself
+STORAGE_FIELDS = ("version", "storage_tier", "original_bytes", "stored_bytes", "archived_at", "integrity")
+
+
+def detect_format(path: Path, explicit: Optional[str] = None) -> str:
+    if explicit:
+        return explicit
+    return "csv" if str(path).lower().endswith(".csv") else "ndjson"
+
+
+def _decode_csv_value(value: str):
+    if value == "":
+        return None
+    if value[:1] in "{[":
+        try:
+            return orjson.loads(value)
+        except orjson.JSONDecodeError:
+            pass
+    return value
+
+
+def _encode_csv_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return orjson.dumps(value).decode()
+    return str(value)
+
+
+def read_records(path: Path, fmt: str) -> Iterator[dict]:
+    """Stream records from a CSV (header row) or NDJSON file"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                yield {key: _decode_csv_value(value) for key, value in row.items()}
+        else:
+            for line in f:
+                if line.strip():
+                    yield orjson.loads(line)
+
+
+class RecordWriter:
+    def __init__(self, f, fmt: str, columns: List[str]):
+        self.f = f
+        self.fmt = fmt
+        self.columns = columns
+        if fmt == "csv":
+            self._csv = csv.writer(f)
+            self._csv.writerow(columns)
+
+    def write(self, records: Iterable[dict]) -> None:
+        if self.fmt == "csv":
+            self._csv.writerows([_encode_csv_value(record.get(c)) for c in self.columns] for record in records)
+        else:
+            self.f.write("".join(orjson.dumps(record).decode() + "\n" for record in records))
+
+
+def batched(records: Iterator[dict], size: int) -> Iterator[List[dict]]:
+    while True:
+        batch = list(itertools.islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+def run_in_order(batches: Iterable, work: Callable, workers: int, commit: Callable) -> None:
+    """
+    Run ``work(batch)`` on a thread pool with a bounded window and hand each
+    result to ``commit(batch, result)`` in input order. ``commit`` returning
+    False stops the run.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, pool.submit(work, batch)))
+            if len(pending) >= workers * 2:
+                batch, future = pending.popleft()
+                if commit(batch, future.result()) is False:
+                    return
+        while pending:
+            batch, future = pending.popleft()
+            if commit(batch, future.result()) is False:
+                return
+
+
+class Checkpoint:
+    """Number of input records committed so far, tied to the input file's size and mtime"""
+
+    def __init__(self, path: Path, source: Path):
+        self.path = Path(path)
+        st = os.stat(source)
+        self.source = {"path": str(source), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def load(self) -> int:
+        try:
+            with open(self.path, "rb") as f:
+                checkpoint = orjson.loads(f.read())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return 0
+        if checkpoint.get("source") != self.source or checkpoint.get("finished_at"):
+            return 0
+        return checkpoint["records_done"]
+
+    def save(self, records_done: int, finished: bool = False) -> None:
+        checkpoint = {"source": self.source, "records_done": records_done}
+        if finished:
+            checkpoint["finished_at"] = datetime.now().isoformat()
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(checkpoint))
+        os.replace(tmp_path, self.path)
+
+
+# Tables
+
+def prepare_account_row(table: str, row: dict, columns: Optional[List[str]]) -> dict:
+    """Map an input row onto the table, hashing any plaintext password"""
+    column = PASSWORD_COLUMNS[table]
+    row = {key: value for key, value in row.items() if value is not None}
+    if not row.get(NATURAL_KEYS[table]):
+        raise ValueError(f"Missing {NATURAL_KEYS[table]}")
+    if column != "password" and "password" in row:
+        row.setdefault(column, row.pop("password"))
+    value = row.get(column)
+    if value:
+        from utils import pwd_context
+        if pwd_context.identify(value, required=False) is None:
+            row[column] = pwd_context.hash(value)
+    if columns:
+        row = {key: value for key, value in row.items() if key in columns}
+    return row
+
+
+class PostgrestTable:
+    """Batches through the Supabase client: one multi-row request per batch"""
+
+    def __init__(self, client, table: str, columns: Optional[List[str]]):
+        self.client = client
+        self.table = table
+        self.columns = columns
+        self.key = NATURAL_KEYS[table]
+
+    def write(self, rows: List[dict]) -> int:
+        """Insert the rows whose natural key is new; returns how many were inserted"""
+        # Replaying a batch after a crash finds its rows already there
+        existing = self.client.table(self.table).select(self.key).in_(
+            self.key, [row[self.key] for row in rows]
+        ).execute().data
+        known = {row[self.key] for row in existing}
+        rows = [row for row in rows if row[self.key] not in known]
+        if rows:
+            self.client.table(self.table).insert(rows).execute()
+        return len(rows)
+
+    def read_page(self, page: int, size: int) -> List[dict]:
+        start = page * size
+        return self.client.table(self.table).select("*").order("id").range(start, start + size - 1).execute().data
+
+
+class CopyTable:
+    """COPY through a per-batch staging table; one connection per worker thread"""
+
+    def __init__(self, dsn: str, table: str):
+        self.dsn = dsn
+        self.table = table
+        self.key = NATURAL_KEYS[table]
+        self._local = threading.local()
+        self._columns: Optional[List[str]] = None
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = psycopg2.connect(self.dsn)
+        return conn
+
+    @property
+    def columns(self) -> List[str]:
+        if self._columns is None:
+            with self._connection() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT column_name FROM information_schema.columns "
+                    "WHERE table_schema = 'public' AND table_name = %s ORDER BY ordinal_position",
+                    (self.table,),
+                )
+                self._columns = [row[0] for row in cursor.fetchall()]
+        return self._columns
+
+    def write(self, rows: List[dict]) -> int:
+        columns = [c for c in self.columns if any(c in row for row in rows)]
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([_encode_csv_value(row.get(c)) for c in columns] for row in rows)
+        buffer.seek(0)
+        column_list = ", ".join(f'"{c}"' for c in columns)
+        with self._connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f'CREATE TEMP TABLE bulk_stage (LIKE "{self.table}" INCLUDING DEFAULTS) ON COMMIT DROP')
+            cursor.copy_expert(f"COPY bulk_stage ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+            # Rows whose natural key is already loaded (e.g. by an interrupted run) are
+            # skipped; ON CONFLICT covers a concurrent batch inserting the same key
+            cursor.execute(
+                f'INSERT INTO "{self.table}" ({column_list}) SELECT {column_list} FROM bulk_stage s '
+                f'WHERE NOT EXISTS (SELECT 1 FROM "{self.table}" t WHERE t."{self.key}" = s."{self.key}") '
+                f'ON CONFLICT DO NOTHING'
+            )
+            return cursor.rowcount
+
+    def export(self, f, fmt: str) -> int:
+        if fmt == "csv":
+            with self._connection() as conn, conn.cursor() as cursor:
+                cursor.copy_expert(
+                    f'COPY (SELECT * FROM "{self.table}" ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)', f
+                )
+                return cursor.rowcount
+        exported = 0
+        with self._connection() as conn, conn.cursor(name="bulk_export") as cursor:
+            cursor.itersize = DEFAULT_BATCH_SIZE
+            cursor.execute(f'SELECT row_to_json(t)::text FROM "{self.table}" t ORDER BY id')
+            for (line,) in cursor:
+                f.write(line + "\n")
+                exported += 1
+        return exported
+
+
+def open_table(table: str):
+    if os.getenv("DATABASE_URL") and psycopg2 is not None:
+        return CopyTable(os.getenv("DATABASE_URL"), table)
+    from manage_tables import TableManager
+    manager = TableManager()
+    try:
+        columns = manager.table_columns(table)
+    except Exception as e:
+        # Projects without the exec_sql function: send rows through unfiltered
+        print(f"Schema introspection unavailable ({e}); columns will not be filtered")
+        columns = None
+    return PostgrestTable(manager.supabase, table, columns)
+
+
+def import_table(table: str, source: Path, fmt: str, checkpoint: Checkpoint, batch_size: int, workers: int) -> Counter:
+    sink = open_table(table)
+    key = NATURAL_KEYS[table]
+    counts = Counter()
+    errors_path = checkpoint.path.with_name(source.name + ".errors.ndjson")
+    done = skip = checkpoint.load()
+    if skip:
+        print(f"Resuming after {skip} records")
+
+    def work(batch):
+        rows, positions, failed = [], [], []
+        seen = set()
+        for position, record in batch:
+            try:
+                row = prepare_account_row(table, record, sink.columns)
+            except Exception as e:
+                failed.append({"line": position + 1, "error": str(e), "record": record})
+                continue
+            if row[key] in seen:
+                continue
+            seen.add(row[key])
+            rows.append(row)
+            positions.append((position, record))
+        try:
+            written = sink.write(rows) if rows else 0
+        except Exception:
+            # Retry one row at a time so a bad row only rejects itself
+            written = 0
+            for row, (position, record) in zip(rows, positions):
+                try:
+                    written += sink.write([row])
+                except Exception as e:
+                    failed.append({"line": position + 1, "error": str(e), "record": record})
+        return written, failed
+
+    def commit(batch, prepared):
+        nonlocal done
+        written, failed = prepared
+        counts["imported"] += written
+        counts["duplicate"] += len(batch) - written - len(failed)
+        if failed:
+            counts["failed"] += len(failed)
+            with open(errors_path, "ab") as f:
+                f.write(b"".join(orjson.dumps(item) + b"\n" for item in failed))
+        done += len(batch)
+        checkpoint.save(done)
+
+    numbered = itertools.islice(enumerate(read_records(source, fmt)), skip, None)
+    run_in_order(batched(numbered, batch_size), work, workers, commit)
+    checkpoint.save(done, finished=True)
+    if counts["failed"]:
+        print(f"Failed records written to {errors_path}")
+    return counts
+
+
+def export_table(table: str, destination: Path, fmt: str, batch_size: int, workers: int) -> int:
+    source = open_table(table)
+    with open(destination, "w", newline="", encoding="utf-8") as f:
+        if isinstance(source, CopyTable):
+            return source.export(f, fmt)
+        writer = None
+        exported = 0
+
+        def commit(page, rows):
+            nonlocal writer, exported
+            if rows:
+                if writer is None:
+                    writer = RecordWriter(f, fmt, source.columns or list(rows[0]))
+                writer.write(rows)
+                exported += len(rows)
+            return len(rows) == batch_size
+
+        # Pages are fetched ahead in parallel; the first short page ends the export
+        run_in_order(itertools.count(), lambda page: source.read_page(page, batch_size), workers, commit)
+    return exported
+
+
+# Documents
+
+def copy_and_hash(source: Path, upload_dir: Path, filename: str):
+    """Copy a file into uploads while hashing it; returns (path, sha256, size)"""
+    sha256 = hashlib.sha256()
+    tmp_path = upload_dir / f".import_{threading.get_ident()}_{os.getpid()}.tmp"
+    size = 0
+    with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            dst.write(chunk)
+            size += len(chunk)
+    # One file per record, named like /upload's, so archiving or deleting one
+    # record's copy never touches another's
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    path = upload_dir / f"{timestamp}_{uuid.uuid4()}_{filename}"
+    os.replace(tmp_path, path)
+    return path, sha256.hexdigest(), size
+
+
+def prepare_document(record: dict, files_dir: Optional[Path]):
+    """
+    Build a metadata record from an input row. Rows with ``source_path`` have
+    that file (relative to ``files_dir``) copied into uploads and hashed; rows
+    without must already carry ``file_path`` and ``file_hash``. Rows without
+    an ``id`` are left without one, for the store to assign on append.
+    Returns (record, path of the copy or None).
+    """
+    from models import DocumentMetadata
+
+    record = {key: value for key, value in record.items() if value is not None and key not in STORAGE_FIELDS}
+    record.setdefault("timestamp", datetime.now().isoformat())
+    source_path = record.pop("source_path", None)
+    copied = None
+    if source_path:
+        source = Path(files_dir or ".") / source_path
+        record.setdefault("original_filename", source.name)
+        copied, file_hash, size = copy_and_hash(source, UPLOAD_DIR, record["original_filename"])
+        if record.get("file_hash") and record["file_hash"] != file_hash:
+            os.remove(copied)
+            raise ValueError(f"{source} does not match the file_hash given for it")
+        record.update(file_path=str(copied), file_hash=file_hash, size=human_size(size))
+    try:
+        # Validated with a stand-in id when the store is to assign one
+        document = dict(record, **DocumentMetadata(**dict({"id": "INV-0000-0000", "name": ""}, **record)).dict())
+    except Exception:
+        if copied:
+            os.remove(copied)
+        raise
+    if "id" not in record:
+        document["id"] = None
+        if "name" not in record:
+            del document["name"]
+    return document, copied
+
+
+def import_documents(
+    source: Path, fmt: str, checkpoint: Checkpoint, batch_size: int, workers: int, files_dir: Optional[Path]
+) -> Counter:
+    document_store = open_document_store()
+    counts = Counter()
+    errors_path = checkpoint.path.with_name(source.name + ".errors.ndjson")
+    done = skip = checkpoint.load()
+    if skip:
+        print(f"Resuming after {skip} records")
+
+    def work(batch):
+        documents, copies, failed = [], [], []
+        for position, record in batch:
+            try:
+                document, copied = prepare_document(record, files_dir)
+            except Exception as e:
+                failed.append({"line": position + 1, "error": str(e), "record": record})
+                continue
+            documents.append(document)
+            if copied:
+                copies.append(str(copied))
+        return documents, copies, failed
+
+    def commit(batch, prepared):
+        nonlocal done
+        documents, copies, failed = prepared
+        # The same file already stamped for the same user, or appearing earlier in
+        # the batch, counts as a duplicate too
+        records, seen = [], set()
+        for document in documents:
+            key = (str(document["user_id"]), document["file_hash"])
+            if key in seen or any(
+                str(doc["user_id"]) == key[0] for doc in document_store.find_by_hash(document["file_hash"])
+            ):
+                continue
+            seen.add(key)
+            records.append(document)
+        # Only caller-supplied ids can be replays; generated ones are drawn until unused
+        added = document_store.extend(records, new_id=new_document_id)
+        counts["imported"] += len(added)
+        counts["duplicate"] += len(documents) - len(added)
+        # Copies made for records that turned out to be duplicates are not referenced
+        kept = {doc["file_path"] for doc in added}
+        for path in copies:
+            if path not in kept:
+                os.remove(path)
+        if failed:
+            counts["failed"] += len(failed)
+            with open(errors_path, "ab") as f:
+                f.write(b"".join(orjson.dumps(item) + b"\n" for item in failed))
+        done += len(batch)
+        checkpoint.save(done)
+
+    numbered = itertools.islice(enumerate(read_records(source, fmt)), skip, None)
+    run_in_order(batched(numbered, batch_size), work, workers, commit)
+    checkpoint.save(done, finished=True)
+    if counts["failed"]:
+        print(f"Failed records written to {errors_path}")
+    return counts
+
+
+def export_documents(destination: Path, fmt: str, user_id: Optional[str]) -> int:
+    document_store = open_document_store()
+    documents = document_store.user_documents(user_id) if user_id else document_store.all_documents()
+    if fmt == "ndjson":
+        # The store already holds each record's JSON
+        with open(destination, "wb") as f:
+            for start in range(0, len(documents), DEFAULT_BATCH_SIZE):
+                chunk = documents[start:start + DEFAULT_BATCH_SIZE]
+                f.write(b"".join(document_store.serialized(doc) + b"\n" for doc in chunk))
+        return len(documents)
+
+    columns = list(dict.fromkeys(key for doc in documents for key in doc))
+    with open(destination, "w", newline="", encoding="utf-8") as f:
+        RecordWriter(f, fmt, columns).write(documents)
+    return len(documents)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export of documents, companies and users")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("target", choices=("documents",) + TABLES)
+    parser.add_argument("path", type=Path, help="input file for import, output file for export")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--files-dir", type=Path, help="base directory for source_path in document imports")
+    parser.add_argument("--user-id", help="export only this user's documents")
+    parser.add_argument("--checkpoint", type=Path, help="defaults to <input>.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and start over")
+    args = parser.parse_args()
+
+    fmt = detect_format(args.path, args.format)
+    if args.command == "export":
+        if args.target == "documents":
+            count = export_documents(args.path, fmt, args.user_id)
+        else:
+            count = export_table(args.target, args.path, fmt, args.batch_size, args.workers)
+        print(f"Exported {count} {args.target} records to {args.path}")
+        return
+
+    checkpoint = Checkpoint(args.checkpoint or args.path.with_name(args.path.name + ".checkpoint.json"), args.path)
+    if args.restart:
+        checkpoint.save(0)
+    if args.target == "documents":
+        counts = import_documents(args.path, fmt, checkpoint, args.batch_size, args.workers, args.files_dir)
+        print(f"Imported documents: {dict(counts)}")
+        print("Run `python similarity.py rebuild` and `python invoice_fields.py rebuild` to index them")
+    else:
+        counts = import_table(args.target, args.path, fmt, checkpoint, args.batch_size, args.workers)
+        print(f"Imported {args.target}: {dict(counts)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Storage locations shared by the API and the maintenance CLIs.
+
+Importing this is cheap (no app, Supabase client or background workers), so
+similarity.py, tiering.py, scrubber.py, invoice_fields.py and bulk.py open
+the same stores as the server without booting it.
+"""
+import random
+import string
+from pathlib import Path, PureWindowsPath
+
+from metadata_store import DocumentStore
+from metrics import stage
+from tiering import document_tier, read_blob
+
+UPLOAD_DIR = Path("uploads")
+
+METADATA_DIR = UPLOAD_DIR / "metadata"
+
+# Metadata JSON file path
+DOCUMENTS_METADATA_FILE = METADATA_DIR / "documents.json"
+
+# Derived indexes over stored uploads
+INDEX_DIR = UPLOAD_DIR / "index"
+MINHASH_INDEX_FILE = INDEX_DIR / "minhash.sqlite3"
+FIELD_INDEX_FILE = INDEX_DIR / "fields.sqlite3"
+
+# Aged uploads, zstd-compressed by tiering.py
+ARCHIVE_DIR = UPLOAD_DIR / "archive"
+
+
+def ensure_dirs() -> None:
+    """Create the upload, metadata, index and archive directories if they don't exist"""
+    for directory in (UPLOAD_DIR, METADATA_DIR, INDEX_DIR, ARCHIVE_DIR):
+        directory.mkdir(exist_ok=True)
+
+
+def open_document_store() -> DocumentStore:
+    ensure_dirs()
+    return DocumentStore(DOCUMENTS_METADATA_FILE)
+
+
+def new_document_id() -> str:
+    """Generate an INV-XXXX-XXXX format ID"""
+    first_part = ''.join(random.choices(string.digits, k=4))
+    second_part = ''.join(random.choices(string.digits, k=4))
+    return f"INV-{first_part}-{second_part}"
+
+
+def human_size(size_bytes: int) -> str:
+    if size_bytes < 1024:
+        return f"{size_bytes} B"
+    elif size_bytes < 1024 * 1024:
+        return f"{size_bytes / 1024:.1f} KB"
+    return f"{size_bytes / (1024 * 1024):.1f} MB"
+
+
+def resolve_upload_path(stored_path: str) -> Path:
+    """Map a stored file_path (possibly written on Windows) onto UPLOAD_DIR"""
+    path = Path(*PureWindowsPath(stored_path).parts)
+    upload_root = UPLOAD_DIR.resolve()
+    resolved = path.resolve()
+    if upload_root not in resolved.parents:
+        raise FileNotFoundError(f"Stored path outside uploads: {stored_path}")
+    return resolved
+
+
+def read_document_bytes(document: dict) -> bytes:
+    """Read the original bytes of the stored upload behind a metadata record, from either tier"""
+    with stage(f"blob.read.{document_tier(document)}"):
+        return read_blob(resolve_upload_path(document["file_path"]))
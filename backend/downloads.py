@@ -0,0 +1,189 @@
+import os
+import re
+from pathlib import Path
+from typing import Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
+
+# Size of each read when the server cannot do zero-copy transfers
+CHUNK_SIZE = 256 * 1024
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def make_etag(file_hash: str) -> str:
+    """Strong ETag for a stored blob, derived from its SHA-256"""
+    return f'"{file_hash}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag (weak comparison, RFC 7232)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header into an inclusive (start, end) pair.
+
+    Returns None when the header is absent or should be ignored (multiple ranges,
+    unknown unit, last byte before first), and raises ValueError when the range
+    cannot be satisfied.
+    """
+    if not range_header:
+        return None
+    match = RANGE_PATTERN.match(range_header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        # Syntactically invalid, so ignored rather than refused (RFC 7233 2.1)
+        return None
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def blob_headers(size: int, etag: str, filename: Optional[str], byte_range: Optional[Tuple[int, int]]) -> dict:
+    """Headers shared by full and partial blob responses"""
+    count = size if byte_range is None else byte_range[1] - byte_range[0] + 1
+    headers = {
+        "content-length": str(count),
+        "accept-ranges": "bytes",
+        "etag": etag,
+    }
+    if byte_range is not None:
+        headers["content-range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+    if filename:
+        headers["content-disposition"] = f'attachment; filename="{filename}"'
+    return headers
+
+
+class BlobFileResponse(Response):
+    """
+    Serve a stored blob, or a byte range of it, straight from disk.
+
+    Uses the ASGI ``http.response.zerocopy`` extension (os.sendfile) when the
+    server advertises it, otherwise falls back to positional reads in the
+    threadpool so the event loop never blocks on disk.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        size: int,
+        etag: str,
+        media_type: str,
+        filename: Optional[str] = None,
+        byte_range: Optional[Tuple[int, int]] = None,
+    ):
+        self.path = path
+        self.background = None
+        self.media_type = media_type
+        if byte_range is None:
+            self.offset, self.count = 0, size
+            self.status_code = 200
+        else:
+            self.offset, self.count = byte_range[0], byte_range[1] - byte_range[0] + 1
+            self.status_code = 206
+        self.init_headers(blob_headers(size, etag, filename, byte_range))
+
+    async def __call__(self, scope, receive, send) -> None:
+        # Open before sending headers: the blob may have been moved (archived) or
+        # removed since the handler looked at it, and that must be a 404, not a
+        # 200 with a broken body
+        try:
+            fd = await run_in_threadpool(os.open, str(self.path), os.O_RDONLY)
+        except FileNotFoundError:
+            await JSONResponse({"detail": "Document file not found"}, status_code=404)(scope, receive, send)
+            return
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            })
+            if scope.get("method") == "HEAD" or self.count == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                with os.fdopen(fd, "rb", closefd=False) as file:
+                    await send({
+                        "type": "http.response.zerocopy",
+                        "file": file,
+                        "offset": self.offset,
+                        "count": self.count,
+                        "more_body": False,
+                    })
+                return
+
+            position, remaining = self.offset, self.count
+            while remaining > 0:
+                chunk = await run_in_threadpool(os.pread, fd, min(CHUNK_SIZE, remaining), position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                remaining -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": remaining > 0,
+                })
+            if remaining > 0:
+                # File shrank underneath us; terminate the body cleanly
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            os.close(fd)
+
+
+class BlobBytesResponse(Response):
+    """Serve a blob, or a byte range of it, that has already been read into memory (archived blobs)"""
+
+    def __init__(
+        self,
+        content: bytes,
+        etag: str,
+        media_type: str,
+        filename: Optional[str] = None,
+        byte_range: Optional[Tuple[int, int]] = None,
+    ):
+        self.background = None
+        self.media_type = media_type
+        if byte_range is None:
+            self.body = content
+            self.status_code = 200
+        else:
+            self.body = content[byte_range[0]:byte_range[1] + 1]
+            self.status_code = 206
+        self.init_headers(blob_headers(len(content), etag, filename, byte_range))
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        body = b"" if scope.get("method") == "HEAD" else self.body
+        await send({"type": "http.response.body", "body": body, "more_body": False})
@@ -0,0 +1,176 @@
+"""
+Server-sent events for document status changes.
+
+``DocumentEvents`` is an in-process pub/sub: the metadata store publishes
+every added or changed record, and each subscribed connection gets it on a
+small bounded queue keyed by user. A single background task sends heartbeats
+to every connection and polls the store for changes written by other
+workers, so an idle connection costs one queue and one suspended generator.
+"""
+import asyncio
+from typing import AsyncIterator, Dict, Optional, Set
+
+from starlette.responses import Response
+
+from metrics import registry
+
+EVENT_STREAM_MEDIA_TYPE = "text/event-stream"
+
+# Heartbeats keep proxies from closing idle streams
+HEARTBEAT_INTERVAL = 15.0
+# How often to look for changes made by other workers while anyone is subscribed
+POLL_INTERVAL = 1.0
+# Events buffered per connection; a client that falls further behind is told to resync
+QUEUE_SIZE = 32
+# Client reconnect delay (ms) sent with the stream
+RETRY_MS = 5000
+
+HEARTBEAT = object()
+RESYNC = object()
+
+registry.describe("eureka_event_subscribers", "gauge", "Open document event streams")
+registry.describe("eureka_events_published_total", "counter", "Document change events delivered to subscribers")
+
+
+def format_event(event: str, data: bytes, event_id: Optional[str] = None) -> bytes:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\n".encode() + b"data: " + data + b"\n\n"
+
+
+class DocumentEvents:
+    def __init__(self, store, queue_size: int = QUEUE_SIZE):
+        self.store = store
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        store.add_listener(self.publish)
+
+    def start(self) -> None:
+        """Bind to the running event loop and start the heartbeat/poll task"""
+        self._loop = asyncio.get_event_loop()
+        self._task = self._loop.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, document: dict) -> None:
+        """Store listener; may be called from any thread"""
+        user_id = document.get("user_id")
+        if self._loop is None or user_id not in self._subscribers:
+            return
+        # Take the event id now, while the store still reflects exactly this change
+        self._loop.call_soon_threadsafe(self._dispatch, user_id, (document, self._event_id(user_id)))
+
+    def _dispatch(self, user_id: str, item) -> None:
+        for queue in self._subscribers.get(user_id, ()):
+            if queue.full():
+                # Too far behind: drop the backlog and have the client refetch instead
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+            else:
+                queue.put_nowait(item)
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        registry.add_gauge("eureka_event_subscribers", 1)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+        registry.add_gauge("eureka_event_subscribers", -1)
+
+    async def _run(self) -> None:
+        since_heartbeat = 0.0
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            if not self._subscribers:
+                continue
+            # A refresh notices writes from other workers and publishes them
+            await self._loop.run_in_executor(None, self.store.all_documents)
+            since_heartbeat += POLL_INTERVAL
+            if since_heartbeat >= HEARTBEAT_INTERVAL:
+                since_heartbeat = 0.0
+                for queues in self._subscribers.values():
+                    for queue in queues:
+                        if not queue.full():
+                            queue.put_nowait(HEARTBEAT)
+
+    def _event_id(self, user_id: str) -> str:
+        # The listing ETag, so a reconnecting client can tell whether it missed anything
+        return self.store.user_etag(user_id).strip('"')
+
+    async def stream(self, user_id: str, last_event_id: Optional[str] = None) -> AsyncIterator[bytes]:
+        queue = self.subscribe(user_id)
+        try:
+            current = self._event_id(user_id)
+            yield f"retry: {RETRY_MS}\n\n".encode()
+            if last_event_id and last_event_id != current:
+                yield format_event("resync", b"{}", current)
+            else:
+                yield format_event("ready", b"{}", current)
+            while True:
+                item = await queue.get()
+                if item is HEARTBEAT:
+                    yield b": heartbeat\n\n"
+                elif item is RESYNC:
+                    yield format_event("resync", b"{}", self._event_id(user_id))
+                else:
+                    document, event_id = item
+                    registry.inc("eureka_events_published_total")
+                    yield format_event("document", self.store.serialized(document), event_id)
+        finally:
+            self.unsubscribe(user_id, queue)
+
+
+class EventStreamResponse(Response):
+    """
+    Streams an event generator until it ends or the client disconnects.
+
+    Starlette's StreamingResponse only notices a disconnect when a write fails,
+    which for an idle stream may be never, so this also listens on ``receive``.
+    """
+
+    media_type = EVENT_STREAM_MEDIA_TYPE
+
+    def __init__(self, events: AsyncIterator[bytes], headers: Optional[dict] = None):
+        self.events = events
+        self.status_code = 200
+        self.background = None
+        self.init_headers(dict(headers or {}, **{"cache-control": "no-cache", "x-accel-buffering": "no"}))
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+
+        async def forward():
+            async for chunk in self.events:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+        async def wait_for_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        tasks = [asyncio.ensure_future(forward()), asyncio.ensure_future(wait_for_disconnect())]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                task.result()
+        finally:
+            # Runs the generator's cleanup (unsubscribe) now rather than at garbage collection
+            await self.events.aclose()
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -0,0 +1,102 @@
+"""
+Idempotency-Key records for uploads.
+
+Maps (user, key) to the file hash and response of the first request that
+used the key, in a SQLite table shared by all workers, so a retried upload
+is answered from the record instead of being stored again. Records expire
+after ``ttl`` seconds.
+
+A request reserves its key before doing any work by inserting a pending
+record (empty response), so of two concurrent requests with the same key
+only one stores the upload; the other sees the reservation and waits for
+the outcome. Reservations not completed within ``pending_timeout`` seconds
+(the worker died) can be taken over.
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import orjson
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    file_hash TEXT NOT NULL,
+    response BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (user_id, key)
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys(created_at);
+"""
+
+# How often (seconds) expired records are purged, piggybacked on writes
+PURGE_INTERVAL = 300.0
+# Response of a record whose request is still in flight
+PENDING = b""
+
+
+class IdempotencyStore:
+    def __init__(self, path: Path, ttl: float = 86400.0, pending_timeout: float = 60.0):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.pending_timeout = pending_timeout
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._purged_at = 0.0
+
+    def reserve(self, user_id: str, key: str, file_hash: str) -> Optional[dict]:
+        """
+        Claim a key for a new request. Returns None if this request now holds
+        it (and must ``put`` or ``release`` it), else the existing record as
+        {"file_hash", "response"}, with response None while still pending.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            # Expired records and abandoned reservations no longer hold the key
+            self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE user_id = ? AND key = ? "
+                "AND (created_at <= ? OR (response = ? AND created_at <= ?))",
+                (user_id, key, now - self.ttl, PENDING, now - self.pending_timeout),
+            )
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO idempotency_keys (user_id, key, file_hash, response, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user_id, key, file_hash, PENDING, now),
+            ).rowcount
+            if inserted:
+                return None
+            row = self._conn.execute(
+                "SELECT file_hash, response FROM idempotency_keys WHERE user_id = ? AND key = ?", (user_id, key)
+            ).fetchone()
+        return {"file_hash": row[0], "response": orjson.loads(row[1]) if row[1] != PENDING else None}
+
+    def put(self, user_id: str, key: str, file_hash: str, response: dict) -> None:
+        """Record the outcome for a key reserved by this request"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO idempotency_keys (user_id, key, file_hash, response, created_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, key) DO UPDATE SET file_hash = excluded.file_hash, "
+                "response = excluded.response, created_at = excluded.created_at",
+                (user_id, key, file_hash, orjson.dumps(response), now),
+            )
+            if now - self._purged_at > PURGE_INTERVAL:
+                self._purged_at = now
+                self._conn.execute("DELETE FROM idempotency_keys WHERE created_at <= ?", (now - self.ttl,))
+
+    def release(self, user_id: str, key: str) -> None:
+        """Give up a reservation without an outcome, so a retry can try again"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE user_id = ? AND key = ? AND response = ?", (user_id, key, PENDING)
+            )
+
+    def delete(self, user_id: str, key: str) -> None:
+        """Forget a key's record, e.g. once the document it points at is gone"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM idempotency_keys WHERE user_id = ? AND key = ?", (user_id, key))
@@ -27,3 +27,13 @@ const registry = new ethers.Contract(REG_ADDR, abiJson.abi, signer);
 const tx = await registry.submitInvoice(md5, CODE, sig);
 console.log('⏳ waiting…'); await tx.wait();
 console.log('✅ stored, tx:', tx.hash);
+
+// Report the anchoring back to the API so subscribed clients see it without polling
+if (process.env.API_URL && process.env.ADMIN_TOKEN) {
+  const res = await fetch(`${process.env.API_URL}/document/${CODE}/status`, {
+    method : 'PATCH',
+    headers: { 'Content-Type': 'application/json', 'X-Admin-Token': process.env.ADMIN_TOKEN },
+    body   : JSON.stringify({ status: 'anchored', tx_hash: tx.hash }),
+  });
+  console.log(res.ok ? '📣 status reported' : `⚠️ status report failed: ${res.status}`);
+}
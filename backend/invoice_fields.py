@@ -0,0 +1,316 @@
+"""
+Structured field extraction for stamped invoices.
+
+Payee, bank details, invoice number and amount are parsed from each stored
+PDF in a process pool, off the request path, into an indexed SQLite table so
+payee/bank-account mismatch checks never have to reprocess files. The same
+pass MinHashes the text for the near-duplicate index, so each upload's text
+is extracted once.
+Rebuild with ``python invoice_fields.py rebuild``.
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from metrics import registry
+from pdf_text import extract_text
+from similarity import MinHashIndex, signature_for_pdf, signature_for_text
+from tiering import read_blob
+
+IBAN_PATTERN = re.compile(r"\b([A-Z]{2}\d{2}(?: ?[A-Z0-9]{4}){2,7}(?: ?[A-Z0-9]{1,3})?)\b")
+SORT_CODE_PATTERN = re.compile(r"sort\s*code\s*[:.]?\s*(\d{2})[-\s]?(\d{2})[-\s]?(\d{2})\b", re.I)
+ACCOUNT_PATTERN = re.compile(r"(?:account|acct|a/c)\s*(?:no|number|num|#)\.?\s*[:.]?\s*(\d{6,12})\b", re.I)
+INVOICE_NUMBER_PATTERN = re.compile(
+    r"invoice\s*(?:no|number|num|#)\.?\s*[:.]?\s*((?=[A-Z0-9\-/]*\d)[A-Z0-9][A-Z0-9\-/]{2,})", re.I
+)
+AMOUNT_PATTERN = re.compile(
+    r"(?:amount\s+due|total\s+due|balance\s+due|grand\s+total|total)\D{0,20}?(\d{1,3}(?:,\d{3})*(?:\.\d{2})|\d+\.\d{2})",
+    re.I,
+)
+CURRENCY_PATTERN = re.compile(r"\b(GBP|EUR|USD)\b|([£€$])")
+CURRENCY_SYMBOLS = {"£": "GBP", "€": "EUR", "$": "USD"}
+PAYEE_PATTERN = re.compile(
+    r"(?:account\s+name|payable\s+to|beneficiary(?:\s+name)?|payee)\s*[:.]?\s+"
+    r"(.{2,80}?)(?=\s+(?:account|acct|sort|iban|swift|bic|address)\b|\n|$)",
+    re.I,
+)
+COMPANY_SUFFIXES = {"ltd", "limited", "plc", "llc", "llp", "inc", "co", "company", "gmbh"}
+
+
+def iban_is_valid(iban: str) -> bool:
+    """ISO 13616 mod-97 check"""
+    rearranged = iban[4:] + iban[:4]
+    digits = "".join(str(int(ch, 36)) for ch in rearranged)
+    return int(digits) % 97 == 1
+
+
+def payee_key(name: Optional[str]) -> Optional[str]:
+    """Normalise a payee name so 'Acme Ltd' and 'ACME LIMITED' compare equal"""
+    if not name:
+        return None
+    words = re.findall(r"[a-z0-9]+", name.lower())
+    while words and words[-1] in COMPANY_SUFFIXES:
+        words.pop()
+    return " ".join(words) or None
+
+
+def parse_invoice_fields(text: str) -> dict:
+    fields = {
+        "invoice_number": None,
+        "amount": None,
+        "currency": None,
+        "payee": None,
+        "iban": None,
+        "sort_code": None,
+        "account_number": None,
+    }
+
+    for match in IBAN_PATTERN.finditer(text):
+        candidate = match.group(1).replace(" ", "")
+        if 15 <= len(candidate) <= 34 and iban_is_valid(candidate):
+            fields["iban"] = candidate
+            break
+
+    match = SORT_CODE_PATTERN.search(text)
+    if match:
+        fields["sort_code"] = "".join(match.groups())
+    match = ACCOUNT_PATTERN.search(text)
+    if match:
+        fields["account_number"] = match.group(1)
+    match = INVOICE_NUMBER_PATTERN.search(text)
+    if match:
+        fields["invoice_number"] = match.group(1).upper()
+    match = AMOUNT_PATTERN.search(text)
+    if match:
+        fields["amount"] = float(match.group(1).replace(",", ""))
+    match = CURRENCY_PATTERN.search(text)
+    if match:
+        fields["currency"] = match.group(1) or CURRENCY_SYMBOLS[match.group(2)]
+    match = PAYEE_PATTERN.search(text)
+    if match:
+        fields["payee"] = re.sub(r"\s+", " ", match.group(1)).strip(" .,:")
+    return fields
+
+
+def extract_from_file(path: str, with_signature: bool = False) -> Tuple[dict, Optional[array]]:
+    """
+    Process-pool entry point: read a stored PDF (from either tier), parse its
+    fields and, if asked, MinHash the same text. Returns (fields, signature).
+    """
+    text = extract_text(read_blob(path))
+    return parse_invoice_fields(text), signature_for_text(text) if with_signature else None
+
+
+def bank_key(fields: dict) -> Optional[str]:
+    """Single comparable value for the bank details on an invoice"""
+    if fields.get("iban"):
+        return f"iban:{fields['iban']}"
+    if fields.get("sort_code") and fields.get("account_number"):
+        return f"uk:{fields['sort_code']}:{fields['account_number']}"
+    return None
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoice_fields (
+    doc_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    invoice_number TEXT,
+    amount REAL,
+    currency TEXT,
+    payee TEXT,
+    payee_key TEXT,
+    iban TEXT,
+    sort_code TEXT,
+    account_number TEXT,
+    bank_key TEXT,
+    extracted_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_invoice_fields_payee_key ON invoice_fields(payee_key, bank_key);
+CREATE INDEX IF NOT EXISTS idx_invoice_fields_bank_key ON invoice_fields(bank_key);
+CREATE INDEX IF NOT EXISTS idx_invoice_fields_invoice_number ON invoice_fields(invoice_number);
+"""
+
+COLUMNS = (
+    "doc_id", "user_id", "invoice_number", "amount", "currency", "payee",
+    "iban", "sort_code", "account_number", "extracted_at",
+)
+
+
+class FieldIndex:
+    """SQLite table of extracted fields, indexed by normalised payee and bank details"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def upsert(self, doc_id: str, user_id: str, fields: dict) -> None:
+        row = (
+            doc_id, user_id, fields.get("invoice_number"), fields.get("amount"),
+            fields.get("currency"), fields.get("payee"), payee_key(fields.get("payee")),
+            fields.get("iban"), fields.get("sort_code"), fields.get("account_number"),
+            bank_key(fields), time.time(),
+        )
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO invoice_fields (doc_id, user_id, invoice_number, amount, currency, "
+                "payee, payee_key, iban, sort_code, account_number, bank_key, extracted_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+
+    def get(self, doc_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM invoice_fields WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def known_ids(self) -> set:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT doc_id FROM invoice_fields")}
+
+    def payee_mismatches(self, payee: str, user_id: str, fields: Optional[dict] = None) -> Tuple[List[dict], int]:
+        """
+        Stamped invoices for a payee whose bank details differ from ``fields``.
+
+        Without bank details, matches every invoice for the payee when more than
+        one distinct set of bank details has been seen for it. Returns the
+        caller's own matching rows, and only a count of other users' matches,
+        whose invoices and bank details are not theirs to see.
+        """
+        key = payee_key(payee)
+        expected = bank_key(fields or {})
+        with self._lock:
+            if expected:
+                rows = self._conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM invoice_fields "
+                    "WHERE payee_key = ? AND bank_key IS NOT NULL AND bank_key != ?",
+                    (key, expected),
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM invoice_fields "
+                    "WHERE payee_key = ? AND bank_key IS NOT NULL "
+                    "AND (SELECT COUNT(DISTINCT bank_key) FROM invoice_fields WHERE payee_key = ?) > 1",
+                    (key, key),
+                ).fetchall()
+        own = [dict(row) for row in rows if row["user_id"] == user_id]
+        return own, len(rows) - len(own)
+
+
+class FieldExtractor:
+    """
+    Submits stored PDFs to a process pool and records the parsed fields, and
+    their MinHash signatures too when given a similarity index
+    """
+
+    def __init__(self, index: FieldIndex, similarity_index: Optional[MinHashIndex] = None,
+                 max_workers: Optional[int] = None):
+        self.index = index
+        self.similarity_index = similarity_index
+        self.max_workers = max_workers or int(os.getenv("FIELD_EXTRACT_WORKERS", "2"))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # Spawn rather than fork: the server process runs logging and executor threads
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def _discard_pool(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    def _submit(self, fn, *args) -> Future:
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (OOM, killed); start a fresh pool rather than failing every later upload
+            self._discard_pool()
+            future = self._get_pool().submit(fn, *args)
+        registry.add_gauge("eureka_pool_queue_depth", 1, pool="field_extraction")
+        future.add_done_callback(lambda done: registry.add_gauge("eureka_pool_queue_depth", -1, pool="field_extraction"))
+        return future
+
+    def submit(self, doc_id: str, user_id: str, path: str) -> Future:
+        """Extract a stored document's fields (and signature); the future resolves to (fields, signature)"""
+        future = self._submit(extract_from_file, path, self.similarity_index is not None)
+
+        def record(done):
+            try:
+                fields, signature = done.result()
+                self.index.upsert(doc_id, user_id, fields)
+            except Exception:
+                registry.inc("eureka_errors_total", stage="field_extraction")
+                return
+            if signature is not None:
+                try:
+                    self.similarity_index.add(doc_id, signature)
+                except Exception:
+                    registry.inc("eureka_errors_total", stage="similarity_index")
+
+        future.add_done_callback(record)
+        return future
+
+    def signature(self, data: bytes) -> Future:
+        """MinHash signature of a PDF that is not stored, e.g. one being checked before upload"""
+        return self._submit(signature_for_pdf, data)
+
+    def shutdown(self, wait: bool = False) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the extracted invoice field index")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--full", action="store_true", help="re-extract documents already in the index")
+    args = parser.parse_args()
+
+    from config import FIELD_INDEX_FILE, open_document_store, resolve_upload_path
+
+    document_store = open_document_store()
+    field_extractor = FieldExtractor(FieldIndex(FIELD_INDEX_FILE))
+    known = set() if args.full else field_extractor.index.known_ids()
+    futures = []
+    for document in document_store.all_documents():
+        if document["id"] in known:
+            continue
+        try:
+            path = resolve_upload_path(document["file_path"])
+        except FileNotFoundError:
+            continue
+        futures.append(field_extractor.submit(document["id"], document["user_id"], str(path)))
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Extraction failed: {e}")
+    # Waiting on the pool also waits for the done-callbacks that write the index
+    field_extractor.shutdown(wait=True)
+    print(f"Extracted fields for {len(futures)} documents")
+
+
+if __name__ == "__main__":
+    main()
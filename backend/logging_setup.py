@@ -0,0 +1,142 @@
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+
+import orjson
+
+# Correlates every log line emitted while handling a request
+request_id_var: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class ContextFilter(logging.Filter):
+    """Attach the current request ID; runs on the caller's thread before queueing"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep one in N records for call sites that pass ``extra={"sample": N}``.
+
+    Kept records get ``sampled=N`` so aggregations can scale counts back up.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._counts = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = getattr(record, "sample", None)
+        if not every or every <= 1:
+            return True
+        key = (record.name, record.msg)
+        count = self._counts.get(key, 0)
+        self._counts[key] = count + 1
+        if count % every:
+            return False
+        record.sampled = every
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; runs on the background writer thread"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        sampled = getattr(record, "sampled", None)
+        if sampled:
+            entry["sampled"] = sampled
+        return orjson.dumps(entry).decode()
+
+
+def _parse_levels(spec: str) -> dict:
+    """Parse ``name=LEVEL,name2=LEVEL`` into a dict"""
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging() -> None:
+    """
+    Route all logging through a queue drained by a background writer thread.
+
+    LOG_LEVEL sets the root level and LOG_LEVELS overrides it per module,
+    e.g. ``LOG_LEVELS=auth=WARNING,metadata_store=DEBUG``.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter())
+        queue_handler.addFilter(ContextFilter())
+
+        writer = logging.StreamHandler(sys.stdout)
+        writer.setFormatter(JsonFormatter())
+
+        root = logging.getLogger()
+        root.handlers = [queue_handler]
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        for name, level in _parse_levels(os.getenv("LOG_LEVELS", "")).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+class RequestIdMiddleware:
+    """ASGI middleware that assigns (or propagates) X-Request-ID for log correlation"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        if not request_id:
+            request_id = uuid.uuid4().hex
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
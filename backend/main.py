@@ -1,51 +1,106 @@
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile
-from auth import verify_token
-from utils import pwd_context
+from fastapi import FastAPI, BackgroundTasks, Depends, Header, HTTPException, status, File, UploadFile, Request
+from admission import AdmissionMiddleware, charge_company
+from auth import verify_token, require_admin
 from supabase import create_client, Client
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
+from config import (
+    DOCUMENTS_METADATA_FILE, FIELD_INDEX_FILE, INDEX_DIR, MINHASH_INDEX_FILE, UPLOAD_DIR,
+    ensure_dirs, human_size, new_document_id, read_document_bytes, resolve_upload_path
+)
+from downloads import BlobBytesResponse, BlobFileResponse, make_etag, etag_matches, parse_range
+from events import DocumentEvents, EventStreamResponse
+from idempotency import IdempotencyStore
+from invoice_fields import FieldExtractor, FieldIndex
+from logging_setup import RequestIdMiddleware, setup_logging
+from metadata_store import DocumentStore, PLACEHOLDER_HASH_PREFIXES
+from metrics import MetricsMiddleware, PROMETHEUS_CONTENT_TYPE, cache_hit, cache_miss, registry, stage
+from passwords import password_service
+from profiler import ProfilerMiddleware, profiler
+from receipts import RECEIPT_MEDIA_TYPE, ReceiptSigner
+from similarity import MinHashIndex
+from tiering import ARCHIVE_TIER, document_tier
 from models import (
     CompanyRegistration, CompanyResponse,
     UserRegistration, UserResponse,
     LoginLogRegistration, UserLogin,
-    DocumentMetadata, DocumentResponse
+    DocumentMetadata, DocumentResponse, DocumentStatusUpdate
 )
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
-from passlib.context import CryptContext
 from datetime import datetime
 import uuid
 import shutil
 from pathlib import Path
 import hashlib
 import json
-import random
-import string
-import re  # For better matching of document ID formats
+import logging
+import mimetypes
+import re
+from typing import Optional, Tuple
 
 load_dotenv()
 
+# Log through a background writer so handlers never block on stdout
+setup_logging()
+logger = logging.getLogger(__name__)
+
 # Enable development mode for easier testing
 os.environ["DEV_MODE"] = "true"
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Create upload, metadata, index and archive directories if they don't exist
+ensure_dirs()
+
+# Cached view over the metadata file; creates it if it doesn't exist
+document_store = DocumentStore(DOCUMENTS_METADATA_FILE)
+
+# Pushes status changes to /events/documents subscribers instead of making clients poll
+document_events = DocumentEvents(document_store)
+
+# Near-duplicate detection over extracted invoice text
+similarity_index = MinHashIndex(MINHASH_INDEX_FILE)
+
+# Idempotency-Key outcomes for /upload retries, shared by all workers
+idempotency_store = IdempotencyStore(
+    INDEX_DIR / "idempotency.sqlite3", ttl=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+)
+
+# Signs offline-verifiable receipts; the key is generated on first use unless provided
+receipt_signer = ReceiptSigner(
+    Path(os.getenv("RECEIPT_KEY_FILE", INDEX_DIR / "receipt_key.pem")), pem=os.getenv("RECEIPT_SIGNING_KEY")
+)
+
+# Extracted payee/bank/amount fields and MinHash signatures, computed from one
+# text extraction per upload in a process pool
+field_index = FieldIndex(FIELD_INDEX_FILE)
+field_extractor = FieldExtractor(field_index, similarity_index)
 
-# Create upload and metadata directories if they don't exist
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
+# How long (seconds) a retry waits for a concurrent request holding its Idempotency-Key
+IDEMPOTENCY_WAIT = 5.0
+IDEMPOTENCY_POLL_INTERVAL = 0.1
 
-METADATA_DIR = Path("uploads/metadata")
-METADATA_DIR.mkdir(exist_ok=True)
+# Listings with more records than this are streamed instead of built in memory
+STREAM_THRESHOLD = 500
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
 
-# Metadata JSON file path
-DOCUMENTS_METADATA_FILE = METADATA_DIR / "documents.json"
+# Listings are private to the user; single records may be cached by shared proxies
+DOCUMENTS_CACHE_CONTROL = "private, no-cache"
+DOCUMENT_CACHE_CONTROL = "public, max-age=10, must-revalidate"
+# Receipts are signed and public, so CDNs may keep them longer than the records
+# themselves; well within the part of a receipt's lifetime left when it is served
+RECEIPT_CACHE_CONTROL = "public, max-age=300, s-maxage=3600"
+RECEIPT_KEYS_CACHE_CONTROL = "public, max-age=86400"
 
-# Create documents metadata file if it doesn't exist
-if not DOCUMENTS_METADATA_FILE.exists():
-    with open(DOCUMENTS_METADATA_FILE, "w") as f:
-        json.dump([], f)
+# Rate limits and concurrency caps for upload/login/register; added before CORS
+# so rejections still carry CORS headers
+app.add_middleware(AdmissionMiddleware)
 
 # Add CORS middleware
 app.add_middleware(
@@ -54,9 +109,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
-    expose_headers=["Content-Disposition"],  # For file downloads
+    expose_headers=["Content-Disposition", "Content-Range", "Accept-Ranges", "ETag", "Retry-After", "Idempotent-Replayed"],  # For file downloads, backoff and upload retries
 )
 
+# Record per-route latency for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Tag each request (and its log lines) with an X-Request-ID
+app.add_middleware(RequestIdMiddleware)
+
+# Counts requests for on-demand profiling sessions; a no-op while disabled
+app.add_middleware(ProfilerMiddleware)
+
 # Mount static files directory
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -75,20 +139,77 @@ try:
         
     supabase: Client = create_client(supabase_url, supabase_key)
 except Exception as e:
-    print(f"Error initializing Supabase client: {e}")
+    logger.error("Error initializing Supabase client: %s", e)
     raise
 
-# Initialize password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@app.on_event("startup")
+def start_event_stream():
+    document_events.start()
+
+@app.on_event("startup")
+def calibrate_password_hashing():
+    password_service.calibrate()
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    document_events.stop()
+    field_extractor.shutdown()
 
 @app.get("/")
 def read_root():
     return {"message": "FastAPI backend is up!"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.post("/admin/profile/start", include_in_schema=False)
+async def start_profiling(
+    seconds: Optional[float] = None,
+    requests: Optional[int] = None,
+    route: Optional[str] = None,
+    interval_ms: float = 5.0,
+    admin=Depends(require_admin)
+):
+    if not seconds and not requests:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide seconds and/or requests to bound the session"
+        )
+    try:
+        profiler.start(seconds=seconds, requests=requests, route=route, interval=interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    logger.warning("Profiling started: seconds=%s requests=%s route=%s", seconds, requests, route)
+    return profiler.status()
+
+@app.post("/admin/profile/stop", include_in_schema=False)
+async def stop_profiling(admin=Depends(require_admin)):
+    profiler.stop()
+    return profiler.status()
+
+@app.get("/admin/profile", include_in_schema=False)
+async def profiling_status(admin=Depends(require_admin)):
+    return profiler.status()
+
+@app.get("/admin/profile/collapsed", include_in_schema=False)
+async def profiling_stacks(admin=Depends(require_admin)):
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={"Content-Disposition": 'attachment; filename="profile.folded"'}
+    )
+
 @app.get("/protected")
 def protected_route(user=Depends(verify_token)):
     return {"message": "You are authenticated!", "user": user}
 
+def store_rehashed_password(table: str, column: str, account_id: str, new_hash: str) -> None:
+    """Background task: replace a password hash upgraded during login"""
+    try:
+        supabase.table(table).update({column: new_hash}).eq("id", str(account_id)).execute()
+    except Exception as e:
+        logger.error("Error storing rehashed password for %s %s: %s", table, account_id, e)
+
 @app.post("/register/company", response_model=CompanyResponse)
 async def register_company(company_data: CompanyRegistration):
     try:
@@ -101,7 +222,7 @@ async def register_company(company_data: CompanyRegistration):
             )
         
         # Hash the password
-        hashed_password = pwd_context.hash(company_data.password)
+        hashed_password = await password_service.hash(company_data.password)
         
         # Create company record
         data = {
@@ -132,14 +253,14 @@ async def register_company(company_data: CompanyRegistration):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error in register_company: {str(e)}")
+        logger.error("Error in register_company: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
 
 @app.post("/login/company")
-async def login_company(email: str, password: str):
+async def login_company(email: str, password: str, background_tasks: BackgroundTasks):
     try:
         # Get company by email
         result = supabase.table("companies").select("*").eq("email", email).execute()
@@ -153,11 +274,14 @@ async def login_company(email: str, password: str):
         company = result.data[0]
         
         # Verify password
-        if not pwd_context.verify(password, company["password"]):
+        password_ok, new_hash = await password_service.verify_and_update(password, company["password"])
+        if not password_ok:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password"
             )
+        if new_hash:
+            background_tasks.add_task(store_rehashed_password, "companies", "password", company["id"], new_hash)
         
         # Return company data without password
         return {
@@ -170,7 +294,7 @@ async def login_company(email: str, password: str):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error in login_company: {str(e)}")
+        logger.error("Error in login_company: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
@@ -196,7 +320,7 @@ async def register_user(user_data: UserRegistration):
             )
 
         # Hash the password
-        hashed_password = pwd_context.hash(user_data.password)
+        hashed_password = await password_service.hash(user_data.password)
 
         # Insert user
         data = {
@@ -226,16 +350,17 @@ async def register_user(user_data: UserRegistration):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error in register_user: {str(e)}")
+        logger.error("Error in register_user: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
 
 @app.post("/login/user")
-async def login_user(credentials: UserLogin):
+async def login_user(credentials: UserLogin, background_tasks: BackgroundTasks):
     try:
-        result = supabase.table("users").select("*").eq("email", credentials.email).execute()
+        with stage("login.select_user"):
+            result = supabase.table("users").select("*").eq("email", credentials.email).execute()
 
         if not result.data:
             raise HTTPException(
@@ -246,16 +371,24 @@ async def login_user(credentials: UserLogin):
         user = result.data[0]
 
         # Check plaintext password against hashed password
-        if not pwd_context.verify(credentials.password, user["password_hash"]):
+        with stage("login.verify_password"):
+            password_ok, new_hash = await password_service.verify_and_update(
+                credentials.password, user["password_hash"]
+            )
+        if not password_ok:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password"
             )
+        # Stored hash predates the current cost; upgrade it after responding
+        if new_hash:
+            background_tasks.add_task(store_rehashed_password, "users", "password_hash", user["id"], new_hash)
 
         # Log the login
-        supabase.table("login_log").insert({
-            "user_id": str(user["id"])
-        }).execute()
+        with stage("login.log_insert"):
+            supabase.table("login_log").insert({
+                "user_id": str(user["id"])
+            }).execute()
 
         # Return user details (no password)
         return {
@@ -268,16 +401,27 @@ async def login_user(credentials: UserLogin):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error in login_user: {str(e)}")
+        logger.error("Error in login_user: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
 
-@app.post("/upload", response_model=DocumentResponse)
-async def upload_file(file: UploadFile = File(...), user=Depends(verify_token)):
+async def company_rate_limit(request: Request, user=Depends(verify_token)):
+    """Per-company budget, charged to the verified user's company rather than token claims"""
+    await charge_company(request.scope, user.get("company_id") or user["id"])
+
+@app.post("/upload", response_model=DocumentResponse, dependencies=[Depends(company_rate_limit)])
+async def upload_file(
+    background_tasks: BackgroundTasks,
+    response: Response,
+    file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    user=Depends(verify_token)
+):
+    reserved_key = None
     try:
-        print(f"Received file upload: {file.filename}")
+        logger.info("Received file upload: %s", file.filename)
         
         # Allow any file type (for submission deadline)
         # if not file.filename.lower().endswith('.pdf'):
@@ -291,19 +435,43 @@ async def upload_file(file: UploadFile = File(...), user=Depends(verify_token)):
         unique_filename = f"{timestamp}_{uuid.uuid4()}_{file.filename}"
         file_path = UPLOAD_DIR / unique_filename
         
-        # Save the file in chunks to handle large files
+        # Read the entire file into memory first (for small files this is fine) and hash it
+        # before anything is written, so repeats can be answered without touching disk
+        content = None
+        sha256_hash = None
         try:
-            with open(file_path, "wb") as buffer:
-                # Read in chunks of 1MB
-                CHUNK_SIZE = 1024 * 1024  # 1MB
-                # Read the entire file into memory first (for small files this is fine)
+            with stage("upload.receive"):
                 content = await file.read()
-                buffer.write(content)
-                
-                # Reset file pointer for future reads
-                await file.seek(0)
+            
+            # Reset file pointer for future reads
+            await file.seek(0)
+            with stage("upload.hash"):
+                sha256_hash = hashlib.sha256(content).hexdigest()
+        except Exception as e:
+            logger.error("Error receiving file: %s", e)
+        
+        # A retry (same Idempotency-Key) or the same bytes again gets the existing stamp
+        if sha256_hash:
+            existing = await find_repeat_upload(user["id"], sha256_hash, idempotency_key)
+            if existing is not None:
+                logger.info("Repeat upload of %s answered with %s", file.filename, existing.id)
+                response.headers["Idempotent-Replayed"] = "true"
+                return existing
+            # This request now holds the key, and must record or release it
+            reserved_key = idempotency_key
+        
+        # Save the file
+        try:
+            if content is None:
+                raise ValueError("Upload could not be read")
+            with stage("upload.write"):
+                with open(file_path, "wb") as buffer:
+                    buffer.write(content)
         except Exception as e:
-            print(f"Error saving file: {str(e)}")
+            logger.error("Error saving file: %s", e)
+            # The stamp must not carry the real hash of bytes that were never
+            # stored, or later uploads of them would be answered with it
+            sha256_hash = f"error-{uuid.uuid4()}"
             # Continue anyway - create a placeholder file
             try:
                 with open(file_path, "wb") as buffer:
@@ -312,35 +480,17 @@ async def upload_file(file: UploadFile = File(...), user=Depends(verify_token)):
             except:
                 pass
         
-        # Calculate SHA256 hash of the file
-        try:
-            if 'content' in locals():
-                sha256_hash = hashlib.sha256(content).hexdigest()
-            else:
-                sha256_hash = f"error-{uuid.uuid4()}"
-        except Exception as e:
-            print(f"Error calculating hash: {str(e)}")
-            sha256_hash = f"error-{uuid.uuid4()}"
-        
-        # Generate INV-XXXX-XXXX format ID
-        first_part = ''.join(random.choices(string.digits, k=4))
-        second_part = ''.join(random.choices(string.digits, k=4))
-        doc_id = f"INV-{first_part}-{second_part}"
+        doc_id = new_document_id()
         
         # Get file size in human-readable format
         try:
-            file_size_bytes = os.path.getsize(file_path)
-            if file_size_bytes < 1024:
-                file_size = f"{file_size_bytes} B"
-            elif file_size_bytes < 1024 * 1024:
-                file_size = f"{file_size_bytes / 1024:.1f} KB"
-            else:
-                file_size = f"{file_size_bytes / (1024 * 1024):.1f} MB"
+            file_size = human_size(os.path.getsize(file_path))
         except Exception as e:
-            print(f"Error getting file size: {str(e)}")
+            logger.error("Error getting file size: %s", e)
             file_size = "Unknown"
         
         # Create document metadata
+        recorded = False
         try:
             doc_metadata = DocumentMetadata(
                 id=doc_id,
@@ -356,31 +506,21 @@ async def upload_file(file: UploadFile = File(...), user=Depends(verify_token)):
                 size=file_size
             )
             
-            # Read existing metadata
-            documents = []
-            if os.path.exists(DOCUMENTS_METADATA_FILE):
-                with open(DOCUMENTS_METADATA_FILE, "r") as f:
-                    try:
-                        documents = json.load(f)
-                    except json.JSONDecodeError:
-                        documents = []
+            # Add new document and save updated metadata
+            with stage("upload.metadata"):
+                await run_in_threadpool(document_store.append, doc_metadata.dict())
+            recorded = True
             
-            # Convert datetime to string for JSON serialization
-            doc_dict = doc_metadata.dict()
-            doc_dict["timestamp"] = doc_metadata.timestamp.isoformat()
-            doc_dict["user_id"] = str(doc_metadata.user_id)
-            
-            # Add new document
-            documents.append(doc_dict)
-            
-            # Save updated metadata
-            with open(DOCUMENTS_METADATA_FILE, "w") as f:
-                json.dump(documents, f, indent=2)
+            # Extract fields and index the text for near-duplicate checks once the response is sent
+            if not sha256_hash.startswith("error-"):
+                background_tasks.add_task(
+                    extract_document_fields, doc_id, user["id"], str(file_path.resolve())
+                )
         except Exception as e:
-            print(f"Error creating/saving metadata: {str(e)}")
+            logger.error("Error creating/saving metadata: %s", e)
         
-        print(f"File saved to {file_path} with ID {doc_id}")
-        return DocumentResponse(
+        logger.info("File saved to %s with ID %s", file_path, doc_id)
+        document_response = DocumentResponse(
             id=doc_id,
             name=f"{doc_id}.pdf",
             file_hash=sha256_hash,
@@ -389,8 +529,25 @@ async def upload_file(file: UploadFile = File(...), user=Depends(verify_token)):
             status="active",
             size=file_size
         )
+        # Only a stored, recorded upload may answer retries of this key
+        if reserved_key:
+            if recorded and not sha256_hash.startswith("error-"):
+                await run_in_threadpool(
+                    idempotency_store.put, user["id"], reserved_key, sha256_hash, document_response.dict()
+                )
+            else:
+                await run_in_threadpool(idempotency_store.release, user["id"], reserved_key)
+        return document_response
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Critical error in upload handler: {str(e)}")
+        logger.error("Critical error in upload handler: %s", e)
+        registry.inc("eureka_errors_total", route="upload_file")
+        if reserved_key:
+            try:
+                await run_in_threadpool(idempotency_store.release, user["id"], reserved_key)
+            except Exception as release_error:
+                logger.error("Error releasing Idempotency-Key: %s", release_error)
         # Generate a fake response to avoid breaking the UI
         emergency_doc_id = f"INV-EMRG-{uuid.uuid4().hex[:4]}"
         return DocumentResponse(
@@ -404,74 +561,456 @@ async def upload_file(file: UploadFile = File(...), user=Depends(verify_token)):
         )
 
 @app.get("/documents")
-async def get_user_documents(user=Depends(verify_token)):
+async def get_user_documents(request: Request, user=Depends(verify_token)):
     try:
-        print(f"Getting documents for user {user['id']}")
+        logger.debug("Getting documents for user %s", user['id'])
+        
+        # Answer revalidations from the in-memory version counters
+        try:
+            etag = document_store.user_etag(user["id"])
+        except json.JSONDecodeError:
+            etag = None
+        cache_headers = {"Cache-Control": DOCUMENTS_CACHE_CONTROL, "Vary": "Authorization"}
+        if etag:
+            cache_headers["ETag"] = etag
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                cache_hit("documents_etag")
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+        cache_miss("documents_etag")
         
-        # Read documents metadata
-        documents = []
-        if os.path.exists(DOCUMENTS_METADATA_FILE):
-            with open(DOCUMENTS_METADATA_FILE, "r") as f:
-                try:
-                    all_documents = json.load(f)
-                    # Filter documents by user ID
-                    documents = [doc for doc in all_documents if doc["user_id"] == user["id"]]
-                except json.JSONDecodeError:
-                    documents = []
+        # Filter documents by user ID
+        try:
+            documents = document_store.user_documents(user["id"])
+        except json.JSONDecodeError:
+            documents = []
         
-        print(f"Found {len(documents)} documents for user {user['id']}")
-        return documents
+        logger.debug("Found %s documents for user %s", len(documents), user['id'])
+        if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+            return StreamingResponse(
+                stream_ndjson(documents), media_type=NDJSON_MEDIA_TYPE, headers=cache_headers
+            )
+        if len(documents) > STREAM_THRESHOLD:
+            return StreamingResponse(
+                stream_json_array(documents), media_type="application/json", headers=cache_headers
+            )
+        body = b"[" + b",".join(document_store.serialized(doc) for doc in documents) + b"]"
+        return Response(content=body, media_type="application/json", headers=cache_headers)
     except Exception as e:
-        print(f"Error getting user documents: {str(e)}")
+        logger.error("Error getting user documents: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
 
+async def stream_json_array(documents: list, batch_size: int = 256):
+    """Yield a JSON array of records in batches, using the cached serialized forms"""
+    yield b"["
+    for start in range(0, len(documents), batch_size):
+        batch = b",".join(document_store.serialized(doc) for doc in documents[start:start + batch_size])
+        yield batch if start == 0 else b"," + batch
+    yield b"]"
+
+async def stream_ndjson(documents: list, batch_size: int = 256):
+    """Yield records as newline-delimited JSON, in batches"""
+    for start in range(0, len(documents), batch_size):
+        yield b"".join(document_store.serialized(doc) + b"\n" for doc in documents[start:start + batch_size])
+
+async def find_repeat_upload(user_id: str, file_hash: str, idempotency_key: Optional[str]) -> Optional[DocumentResponse]:
+    """
+    The response already issued for this key, or for the same bytes from the
+    same user. With a key, a None result means this request has reserved it.
+    """
+    if idempotency_key:
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT
+        while True:
+            record = await run_in_threadpool(idempotency_store.reserve, user_id, idempotency_key, file_hash)
+            if record is None:
+                cache_miss("upload_idempotency")
+                break
+            if record["file_hash"] != file_hash:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="Idempotency-Key was already used for a different file"
+                )
+            if record["response"] is not None:
+                replayed = await run_in_threadpool(current_response, record["response"])
+                if replayed is not None:
+                    cache_hit("upload_idempotency")
+                    return replayed
+                # The stamp it answered with is gone; treat the key as unused
+                await run_in_threadpool(idempotency_store.delete, user_id, idempotency_key)
+                continue
+            # Another request with this key is still storing the upload
+            if time.monotonic() >= deadline:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="A request with this Idempotency-Key is still in progress",
+                    headers={"Retry-After": "1"}
+                )
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+    existing = await run_in_threadpool(find_stamp_for_hash, user_id, file_hash)
+    if existing is None:
+        cache_miss("upload_hash")
+        return None
+    cache_hit("upload_hash")
+    if idempotency_key:
+        await run_in_threadpool(idempotency_store.put, user_id, idempotency_key, file_hash, existing.dict())
+    return existing
+
+def find_stamp_for_hash(user_id: str, file_hash: str) -> Optional[DocumentResponse]:
+    """The user's current stamp for these bytes, if any"""
+    for document in document_store.find_by_hash(file_hash):
+        # A revoked stamp is not reused; uploading the file again issues a new one
+        if str(document["user_id"]) == user_id and document.get("status") != "revoked":
+            return DocumentResponse(
+                id=document["id"],
+                name=document["name"],
+                file_hash=document["file_hash"],
+                user_id=document["user_id"],
+                timestamp=document["timestamp"],
+                status=document["status"],
+                size=document.get("size")
+            )
+    return None
+
+def current_response(response: dict) -> Optional[DocumentResponse]:
+    """A recorded upload response with its stamp's current status; None if the stamp is gone"""
+    document = document_store.find(response["id"])
+    if document is None:
+        return None
+    return DocumentResponse(**dict(response, status=document["status"]))
+
+def extract_document_fields(document_id: str, user_id: str, path: str) -> None:
+    """Background ingest stage: hand the stored PDF to the extraction pool (fields and similarity)"""
+    try:
+        field_extractor.submit(document_id, user_id, path)
+    except Exception as e:
+        registry.inc("eureka_errors_total", stage="field_extraction")
+        logger.error("Error queueing field extraction for %s: %s", document_id, e)
+
+def describe_matches(matches: list, user_id: str) -> Tuple[list, int]:
+    """
+    Attach the stored hash and status to the caller's own similarity matches.
+    Other users' matches are only counted, never listed.
+    """
+    described, other_tenants = [], 0
+    for match in matches:
+        document = document_store.find(match["id"])
+        if not document:
+            continue
+        if document["user_id"] != user_id:
+            other_tenants += 1
+            continue
+        described.append(dict(match, file_hash=document["file_hash"], status=document["status"]))
+    return described, other_tenants
+
 @app.get("/document/{document_id}")
-async def get_document_by_id(document_id: str):
+async def get_document_by_id(document_id: str, request: Request):
     try:
-        print(f"Getting document with ID: {document_id}")
+        logger.debug("Getting document with ID: %s", document_id)
         
-        if not os.path.exists(DOCUMENTS_METADATA_FILE):
-            print(f"Documents file not found: {DOCUMENTS_METADATA_FILE}")
+        # Look the document up in the cached metadata
+        try:
+            document = document_store.find(document_id)
+        except json.JSONDecodeError as e:
+            logger.error("Error parsing documents metadata: %s", e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error parsing documents metadata"
+            )
+        
+        if not document:
+            logger.info("Document not found with ID: %s", document_id)
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Document not found"
             )
         
-        # Read all documents from the metadata file
-        with open(DOCUMENTS_METADATA_FILE, "r") as f:
-            try:
-                all_documents = json.load(f)
-            except json.JSONDecodeError as e:
-                print(f"Error parsing documents metadata: {e}")
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Error parsing documents metadata"
-                )
-        
-        # Clean up and standardize document_id format
-        clean_id = re.sub(r'[^a-zA-Z0-9-]', '', document_id).upper()
-        
-        # Try both exact match and case-insensitive match
-        document = next((doc for doc in all_documents if doc["id"] == document_id), None)
-        if not document:
-            document = next((doc for doc in all_documents if doc["id"].upper() == clean_id), None)
+        cache_headers = {
+            "ETag": document_store.document_etag(document),
+            "Cache-Control": DOCUMENT_CACHE_CONTROL
+        }
+        if etag_matches(request.headers.get("if-none-match"), cache_headers["ETag"]):
+            cache_hit("document_etag")
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+        cache_miss("document_etag")
         
-        if not document:
-            print(f"Document not found with ID: {document_id}")
+        logger.debug("Found document: %s", document['id'])
+        return Response(
+            content=document_store.serialized(document),
+            media_type="application/json",
+            headers=cache_headers
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error getting document by ID: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@app.patch("/document/{document_id}/status")
+async def update_document_status(document_id: str, update: DocumentStatusUpdate, admin=Depends(require_admin)):
+    """Called by the chain submitter as an invoice is anchored, revoked or completed"""
+    document = document_store.find(document_id)
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
+
+    fields = {k: v for k, v in update.dict().items() if v is not None}
+    fields["status_updated_at"] = datetime.now().isoformat()
+    # Subscribers of /events/documents are notified by the store
+    updated = await run_in_threadpool(document_store.update, document["id"], **fields)
+    return Response(
+        content=document_store.serialized(updated),
+        media_type="application/json",
+        headers={"ETag": document_store.document_etag(updated)}
+    )
+
+@app.get("/document/{document_id}/receipt")
+async def get_document_receipt(document_id: str, request: Request):
+    """
+    Signed receipt for a stamped document, checkable offline against the file
+    with verify_receipt.py and the keys from /receipts/keys
+    """
+    document = document_store.find(document_id)
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
+
+    if document["file_hash"].startswith(PLACEHOLDER_HASH_PREFIXES):
+        # Placeholder record for an upload whose file was never stored
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Document has no stored file to issue a receipt for"
+        )
+
+    with stage("receipt.sign"):
+        token, etag = await run_in_threadpool(receipt_signer.sign, document)
+    cache_headers = {
+        "ETag": etag,
+        "Cache-Control": RECEIPT_CACHE_CONTROL
+    }
+    if etag_matches(request.headers.get("if-none-match"), cache_headers["ETag"]):
+        cache_hit("receipt_etag")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+    cache_miss("receipt_etag")
+    return Response(content=token, media_type=RECEIPT_MEDIA_TYPE, headers=cache_headers)
+
+@app.get("/receipts/keys")
+async def get_receipt_keys():
+    """Public keys receipts are signed with, as a JWK Set"""
+    return ORJSONResponse(receipt_signer.jwks(), headers={"Cache-Control": RECEIPT_KEYS_CACHE_CONTROL})
+
+@app.get("/events/documents")
+async def document_events_stream(last_event_id: Optional[str] = Header(None), user=Depends(verify_token)):
+    """
+    Server-sent events for the user's documents: one ``document`` event with the
+    full record per change. Event ids are the /documents ETag, so a client
+    reconnecting with Last-Event-ID gets a ``resync`` event if it missed anything.
+    """
+    return EventStreamResponse(document_events.stream(user["id"], last_event_id))
+
+@app.api_route("/document/{document_id}/file", methods=["GET", "HEAD"])
+async def download_document(document_id: str, request: Request, user=Depends(verify_token)):
+    try:
+        try:
+            document = document_store.find(document_id)
+        except json.JSONDecodeError as e:
+            logger.error("Error parsing documents metadata: %s", e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error parsing documents metadata"
+            )
+
+        if not document or document["user_id"] != user["id"]:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Document not found"
             )
-        
-        print(f"Found document: {document['id']}")
-        return document
+
+        # The stored hash identifies the bytes, so a matching ETag needs no disk access
+        etag = make_etag(document["file_hash"])
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            cache_hit("download_etag")
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        cache_miss("download_etag")
+
+        # Archived blobs are decompressed in full; hot ones are streamed from disk
+        content = None
+        try:
+            if document_tier(document) == ARCHIVE_TIER:
+                content = await run_in_threadpool(read_document_bytes, document)
+                size = len(content)
+            else:
+                file_path = resolve_upload_path(document["file_path"])
+                size = os.stat(file_path).st_size
+        except FileNotFoundError:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Document file not found"
+            )
+
+        # Honour Range only if If-Range (when sent) still matches the current ETag
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if if_range and if_range.strip() != etag:
+            range_header = None
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={"Content-Range": f"bytes */{size}", "ETag": etag}
+            )
+
+        media_type = mimetypes.guess_type(document["original_filename"])[0] or "application/octet-stream"
+        if content is not None:
+            return BlobBytesResponse(
+                content=content,
+                etag=etag,
+                media_type=media_type,
+                filename=document["name"],
+                byte_range=byte_range
+            )
+        return BlobFileResponse(
+            path=file_path,
+            size=size,
+            etag=etag,
+            media_type=media_type,
+            filename=document["name"],
+            byte_range=byte_range
+        )
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error getting document by ID: {str(e)}")
+        logger.error("Error downloading document: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@app.get("/document/{document_id}/similar")
+async def get_similar_documents(
+    document_id: str, limit: int = 5, min_similarity: float = 0.5, user=Depends(verify_token)
+):
+    try:
+        document = document_store.find(document_id)
+        if not document or document["user_id"] != user["id"]:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Document not found"
+            )
+
+        signature = await run_in_threadpool(similarity_index.signature, document["id"])
+        if signature is None:
+            # Not indexed yet (e.g. uploaded before the index existed); extracting
+            # it indexes it, and refreshes its fields, for next time
+            try:
+                path = resolve_upload_path(document["file_path"])
+                with stage("similarity.signature"):
+                    _, signature = await asyncio.wrap_future(
+                        field_extractor.submit(document["id"], document["user_id"], str(path))
+                    )
+            except FileNotFoundError:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Document file not found"
+                )
+            if signature is None:
+                return {"id": document["id"], "matches": [], "other_tenant_matches": 0}
+
+        with stage("similarity.query"):
+            matches = await run_in_threadpool(
+                similarity_index.query, signature, limit=limit, min_similarity=min_similarity, exclude=document["id"]
+            )
+        own, other_tenants = describe_matches(matches, user["id"])
+        return {"id": document["id"], "matches": own, "other_tenant_matches": other_tenants}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error finding similar documents: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@app.post("/verify/similar")
+async def verify_similar(
+    file: UploadFile = File(...), limit: int = 5, min_similarity: float = 0.5, user=Depends(verify_token)
+):
+    try:
+        content = await file.read()
+        file_hash = hashlib.sha256(content).hexdigest()
+        exact = document_store.find_by_hash(file_hash)
+
+        with stage("similarity.signature"):
+            signature = await asyncio.wrap_future(field_extractor.signature(content))
+        matches = []
+        if signature is not None:
+            with stage("similarity.query"):
+                matches = await run_in_threadpool(
+                    similarity_index.query, signature, limit=limit, min_similarity=min_similarity
+                )
+        own, other_tenants = describe_matches(matches, user["id"])
+        return {
+            "file_hash": file_hash,
+            "exact_matches": [doc["id"] for doc in exact if doc["user_id"] == user["id"]],
+            "other_tenant_exact_matches": sum(1 for doc in exact if doc["user_id"] != user["id"]),
+            "matches": own,
+            "other_tenant_matches": other_tenants,
+        }
+    except Exception as e:
+        logger.error("Error checking upload for near duplicates: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@app.get("/document/{document_id}/fields")
+async def get_document_fields(document_id: str, user=Depends(verify_token)):
+    document = document_store.find(document_id)
+    if not document or document["user_id"] != user["id"]:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
+    fields = await run_in_threadpool(field_index.get, document["id"])
+    if not fields:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Fields have not been extracted for this document yet"
+        )
+    return fields
+
+@app.get("/fraud/payee-mismatches")
+async def get_payee_mismatches(
+    payee: str,
+    iban: Optional[str] = None,
+    sort_code: Optional[str] = None,
+    account_number: Optional[str] = None,
+    user=Depends(verify_token)
+):
+    try:
+        expected = {
+            "iban": iban.replace(" ", "").upper() if iban else None,
+            "sort_code": re.sub(r"\D", "", sort_code) if sort_code else None,
+            "account_number": account_number,
+        }
+        with stage("fraud.payee_mismatches"):
+            mismatches, other_tenants = await run_in_threadpool(
+                field_index.payee_mismatches, payee, user["id"], expected
+            )
+        # Other tenants' invoices are only counted, never listed
+        return {"payee": payee, "mismatches": mismatches, "other_tenant_mismatches": other_tenants}
+    except Exception as e:
+        logger.error("Error checking payee mismatches: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
@@ -1,13 +1,16 @@
 import os
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 load_dotenv()
 
 class TableManager:
-    def __init__(self):
-        self.supabase = self._get_supabase_client()
+    def __init__(self, client: Optional[Client] = None):
+        self.supabase = client or self._get_supabase_client()
+        # Schema introspection results, cached for the life of this manager
+        self._tables: Optional[List[str]] = None
+        self._columns: Dict[str, List[str]] = {}
     
     def _get_supabase_client(self) -> Client:
         """Get the Supabase client"""
@@ -23,14 +26,20 @@ class TableManager:
         """Create tables using the provided SQL"""
         try:
             result = self.supabase.rpc('exec_sql', {'sql': sql}).execute()
+            self.invalidate_schema()
             print("✅ Tables created successfully!")
         except Exception as e:
             print(f"❌ Error creating tables: {e}")
             raise
     
-    def list_tables(self) -> List[str]:
-        """List all tables in the database"""
-        try:
+    def invalidate_schema(self) -> None:
+        """Forget cached introspection, e.g. after DDL"""
+        self._tables = None
+        self._columns = {}
+
+    def tables(self, refresh: bool = False) -> List[str]:
+        """Table names in the public schema, queried once per manager"""
+        if self._tables is None or refresh:
             # This is a simple query to get table names
             sql = """
             SELECT table_name 
@@ -38,7 +47,26 @@ class TableManager:
             WHERE table_schema = 'public'
             """
             result = self.supabase.rpc('exec_sql', {'sql': sql}).execute()
-            tables = [row['table_name'] for row in result.data]
+            self._tables = [row['table_name'] for row in result.data]
+        return self._tables
+
+    def table_columns(self, table_name: str) -> List[str]:
+        """Column names of a public table in ordinal order, queried once per table"""
+        if table_name not in self._columns:
+            sql = f"""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = '{table_name.replace("'", "''")}'
+            ORDER BY ordinal_position
+            """
+            result = self.supabase.rpc('exec_sql', {'sql': sql}).execute()
+            self._columns[table_name] = [row['column_name'] for row in result.data]
+        return self._columns[table_name]
+
+    def list_tables(self) -> List[str]:
+        """List all tables in the database"""
+        try:
+            tables = self.tables(refresh=True)
             print("\nCurrent tables in database:")
             for table in tables:
                 print(f"  - {table}")
@@ -50,8 +78,7 @@ class TableManager:
     def check_table_exists(self, table_name: str) -> bool:
         """Check if a specific table exists"""
         try:
-            tables = self.list_tables()
-            exists = table_name in tables
+            exists = table_name in self.tables()
             print(f"\nTable '{table_name}' exists: {exists}")
             return exists
         except Exception as e:
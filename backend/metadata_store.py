@@ -0,0 +1,248 @@
+import orjson
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl  # Cross-process write lock, POSIX only
+except ImportError:
+    fcntl = None
+
+# How often (seconds) to stat the metadata file for changes made by other workers
+STAT_INTERVAL = 0.5
+
+# file_hash prefixes of records written when an upload's bytes could not be
+# stored; there is no real file behind them to verify, archive or vouch for
+PLACEHOLDER_HASH_PREFIXES = ("error-", "emergency-")
+
+
+class DocumentStore:
+    """
+    In-process cache over the documents metadata file.
+
+    Every record carries a ``version`` counter that is bumped on each write, and
+    per-user versions are derived from those counters, so ETags are stable across
+    workers and can be checked without re-reading or re-serializing anything.
+    The serialized JSON of each record is cached too, and is reused both for
+    responses and for rewriting the file.
+
+    Listeners registered with ``add_listener`` are called with every record
+    that is added or changed, whether by this process or (noticed on the next
+    refresh) by another worker.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._documents: List[dict] = []
+        self._by_id: Dict[str, dict] = {}
+        self._by_upper_id: Dict[str, dict] = {}
+        self._by_user: Dict[str, List[dict]] = {}
+        self._by_hash: Dict[str, List[dict]] = {}
+        self._user_versions: Dict[str, Tuple[int, int]] = {}
+        # id(record) -> (record, serialized bytes); holding the record keeps its id() unique
+        self._serialized: Dict[int, Tuple[dict, bytes]] = {}
+        self._file_state: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._listeners: List[Callable[[dict], None]] = []
+
+        # Create documents metadata file if it doesn't exist
+        if not self.path.exists():
+            self._write([])
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _refresh(self, now: bool = False) -> None:
+        """
+        Reload the file if it changed on disk since the last load. The stat is
+        rate-limited to one per STAT_INTERVAL unless ``now`` is set.
+        """
+        checked_at = time.monotonic()
+        if not now and self._file_state is not None and checked_at - self._checked_at < STAT_INTERVAL:
+            return
+        self._checked_at = checked_at
+        state = self._stat()
+        if state == self._file_state:
+            return
+        documents = []
+        if state is not None:
+            with open(self.path, "rb") as f:
+                documents = orjson.loads(f.read())
+        changed = []
+        if self._listeners and self._file_state is not None:
+            known = {doc["id"]: doc.get("version", 1) for doc in self._documents}
+            changed = [doc for doc in documents if known.get(doc["id"]) != doc.get("version", 1)]
+        self._index(documents)
+        self._file_state = state
+        self._notify(changed)
+
+    def _index(self, documents: List[dict]) -> None:
+        previous = self._serialized
+        self._serialized = {}
+        for doc in documents:
+            entry = previous.get(id(doc))
+            if entry is not None and entry[0] is doc:
+                self._serialized[id(doc)] = entry
+        self._documents = documents
+        self._by_id = {}
+        self._by_upper_id = {}
+        self._by_user = {}
+        self._by_hash = {}
+        self._user_versions = {}
+        for doc in documents:
+            self._index_one(doc)
+
+    def _index_one(self, doc: dict) -> None:
+        self._by_id.setdefault(doc["id"], doc)
+        self._by_upper_id.setdefault(doc["id"].upper(), doc)
+        user_id = doc["user_id"]
+        self._by_user.setdefault(user_id, []).append(doc)
+        self._by_hash.setdefault(doc["file_hash"], []).append(doc)
+        count, total = self._user_versions.get(user_id, (0, 0))
+        self._user_versions[user_id] = (count + 1, total + doc.get("version", 1))
+
+    def _write(self, documents: List[dict]) -> None:
+        # One record per line, built from the cached per-record serializations
+        tmp_path = self.path.with_suffix(".json.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(b"[\n" + b",\n".join(self.serialized(doc) for doc in documents) + b"\n]\n")
+        os.replace(tmp_path, self.path)
+
+    def add_listener(self, listener: Callable[[dict], None]) -> None:
+        """Call ``listener(record)`` for each added or changed record; it must not block"""
+        self._listeners.append(listener)
+
+    def _notify(self, documents: List[dict]) -> None:
+        for doc in documents:
+            for listener in self._listeners:
+                listener(doc)
+
+    def _locked_update(self, mutate) -> Optional[dict]:
+        lock_file = None
+        with self._lock:
+            try:
+                if fcntl is not None:
+                    lock_file = open(self.path.with_suffix(".lock"), "w")
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # Under the flock; reloads (losing cached serializations) only
+                # if another worker wrote since our last load or write
+                self._refresh(now=True)
+                documents = list(self._documents)
+                result = mutate(documents)
+                self._write(documents)
+                self._index(documents)
+                self._file_state = self._stat()
+                if result is not None:
+                    self._notify([result])
+                return result
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+
+    def append(self, record: dict) -> dict:
+        """Append a new document record and persist it"""
+        # Normalise datetimes and UUIDs to their JSON forms in one pass
+        record = orjson.loads(orjson.dumps(dict(record, version=1)))
+
+        def mutate(documents):
+            documents.append(record)
+            return record
+
+        return self._locked_update(mutate)
+
+    def extend(self, records: List[dict], new_id: Optional[Callable[[], str]] = None) -> List[dict]:
+        """
+        Append many records in one locked rewrite of the file. Records whose id
+        is already stored are skipped, so replaying a batch is harmless.
+        Records without an id get one from ``new_id``, drawn under the lock
+        until it is unused (and ``name`` defaults to ``<id>.pdf``).
+        Returns the records that were added.
+        """
+        records = orjson.loads(orjson.dumps([dict(record, version=1) for record in records]))
+        added = []
+
+        def mutate(documents):
+            known = {doc["id"] for doc in documents}
+            for record in records:
+                if record.get("id") is None:
+                    document_id = new_id()
+                    while document_id in known:
+                        document_id = new_id()
+                    record["id"] = document_id
+                    record.setdefault("name", f"{document_id}.pdf")
+                if record["id"] not in known:
+                    known.add(record["id"])
+                    documents.append(record)
+                    added.append(record)
+            return None
+
+        self._locked_update(mutate)
+        self._notify(added)
+        return added
+
+    def update(self, document_id: str, **fields) -> Optional[dict]:
+        """Update fields on an existing record, bumping its version"""
+
+        def mutate(documents):
+            for i, doc in enumerate(documents):
+                if doc["id"] == document_id:
+                    documents[i] = dict(doc, **fields, version=doc.get("version", 1) + 1)
+                    return documents[i]
+            return None
+
+        return self._locked_update(mutate)
+
+    def all_documents(self) -> List[dict]:
+        with self._lock:
+            self._refresh()
+            return self._documents
+
+    def user_documents(self, user_id: str) -> List[dict]:
+        with self._lock:
+            self._refresh()
+            return list(self._by_user.get(user_id, []))
+
+    def serialized(self, document: dict) -> bytes:
+        """JSON bytes for a record, computed once per record version"""
+        entry = self._serialized.get(id(document))
+        if entry is None or entry[0] is not document:
+            entry = (document, orjson.dumps(document))
+            self._serialized[id(document)] = entry
+        return entry[1]
+
+    def find(self, document_id: str) -> Optional[dict]:
+        """Find a document by exact ID, falling back to a normalised case-insensitive match"""
+        with self._lock:
+            self._refresh()
+            document = self._by_id.get(document_id)
+            if not document:
+                # Clean up and standardize document_id format
+                clean_id = re.sub(r'[^a-zA-Z0-9-]', '', document_id).upper()
+                document = self._by_upper_id.get(clean_id)
+            return document
+
+    def find_by_hash(self, file_hash: str) -> List[dict]:
+        """All documents whose stored SHA-256 matches"""
+        with self._lock:
+            self._refresh()
+            return list(self._by_hash.get(file_hash, []))
+
+    def user_etag(self, user_id: str) -> str:
+        """ETag for a user's document listing"""
+        with self._lock:
+            self._refresh()
+            count, total = self._user_versions.get(user_id, (0, 0))
+        return f'"{user_id}.{count}.{total}"'
+
+    @staticmethod
+    def document_etag(document: dict) -> str:
+        """ETag for a single document record"""
+        return f'"{document["id"]}.{document.get("version", 1)}"'
@@ -0,0 +1,206 @@
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, Tuple
+
+# Latency buckets in seconds, from sub-millisecond cache hits up to slow uploads
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: Iterable[Tuple[str, str]]) -> str:
+    parts = []
+    for name, value in key:
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Fixed-bucket histogram; observing is a bisect and two additions"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Process-local counters, gauges and histograms, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def add_gauge(self, name: str, amount: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def render(self) -> str:
+        """Render all series in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, families in (("counter", self._counters), ("gauge", self._gauges)):
+                for name, series in sorted(families.items()):
+                    lines.extend(self._header(name, kind))
+                    for key, value in series.items():
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.extend(self._header(name, "histogram"))
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', repr(bound)),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, name: str, kind: str):
+        _, help_text = self._help.get(name, (kind, name))
+        return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+registry = MetricsRegistry()
+registry.describe("eureka_request_duration_seconds", "histogram", "HTTP request latency by route")
+registry.describe("eureka_stage_duration_seconds", "histogram", "Latency of named stages inside handlers")
+registry.describe("eureka_requests_in_flight", "gauge", "Requests currently being handled")
+registry.describe("eureka_errors_total", "counter", "Errors by route or stage")
+registry.describe("eureka_cache_hits_total", "counter", "Cache hits by cache name")
+registry.describe("eureka_cache_misses_total", "counter", "Cache misses by cache name")
+registry.describe("eureka_pool_queue_depth", "gauge", "Tasks waiting in worker pools")
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as a named stage; errors are counted and re-raised"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        registry.inc("eureka_errors_total", stage=name)
+        raise
+    finally:
+        registry.observe("eureka_stage_duration_seconds", time.perf_counter() - start, stage=name)
+
+
+def timed(name: str):
+    """Decorator form of ``stage`` for sync and async functions"""
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def cache_hit(cache: str) -> None:
+    registry.inc("eureka_cache_hits_total", cache=cache)
+
+
+def cache_miss(cache: str) -> None:
+    registry.inc("eureka_cache_misses_total", cache=cache)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, status and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        registry.add_gauge("eureka_requests_in_flight", 1)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            registry.add_gauge("eureka_requests_in_flight", -1)
+            # The router stores the matched endpoint in the scope
+            endpoint = scope.get("endpoint")
+            route = getattr(endpoint, "__name__", "unmatched")
+            registry.observe(
+                "eureka_request_duration_seconds",
+                time.perf_counter() - start,
+                route=route,
+                method=scope["method"],
+                status=status_code,
+            )
+            if status_code >= 500:
+                registry.inc("eureka_errors_total", route=route)
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
 from pydantic.types import constr
-from typing import Annotated, Optional
+from typing import Annotated, List, Literal, Optional
 from datetime import datetime
 import uuid
 
@@ -67,3 +67,12 @@ class DocumentResponse(BaseModel):
     timestamp: str
     status: str
     size: Optional[str] = None
+
+# Reported by the chain submitter as a stamped invoice moves through its lifecycle
+class DocumentStatusUpdate(BaseModel):
+    status: Literal["active", "anchored", "revoked", "completed"]
+    tx_hash: Optional[str] = None
+    block_number: Optional[int] = None
+    # Set when the invoice was anchored as one leaf of a batched Merkle root
+    merkle_root: Optional[str] = None
+    merkle_proof: Optional[List[str]] = None
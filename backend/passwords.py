@@ -0,0 +1,118 @@
+"""
+Password hashing service.
+
+One bcrypt ``CryptContext`` for the whole backend. At startup its cost is
+calibrated on this host against ``PASSWORD_HASH_TARGET_MS``; hashes weaker
+than the calibrated cost are upgraded transparently on the next successful
+login. Hashing and verification run in the threadpool behind a semaphore
+sized to the CPU count, so a login flood queues (and eventually gets 503s)
+instead of tying up every worker thread.
+"""
+import asyncio
+import logging
+import math
+import os
+import statistics
+import time
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Never go below this cost, however slow the host
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+DEFAULT_ROUNDS = 12
+# Cheap cost used to time the host; each extra round doubles the work
+PROBE_ROUNDS = 8
+PROBE_SAMPLES = 5
+
+registry.describe("eureka_password_hash_rounds", "gauge", "bcrypt cost used for new password hashes")
+
+
+def calibrate_rounds(target_ms: float, min_rounds: int = MIN_ROUNDS, max_rounds: int = MAX_ROUNDS) -> int:
+    """Highest bcrypt cost whose hash time on this host stays within ``target_ms``"""
+    probe = CryptContext(schemes=["bcrypt"], bcrypt__rounds=PROBE_ROUNDS)
+    timings = []
+    for _ in range(PROBE_SAMPLES):
+        start = time.perf_counter()
+        probe.hash("calibration")
+        timings.append((time.perf_counter() - start) * 1000)
+    probe_ms = statistics.median(timings)
+    rounds = PROBE_ROUNDS + math.floor(math.log2(target_ms / probe_ms))
+    return max(min_rounds, min(max_rounds, rounds))
+
+
+class PasswordService:
+    def __init__(
+        self,
+        target_ms: float = 250.0,
+        concurrency: Optional[int] = None,
+        queue_timeout: float = 5.0,
+        rounds: Optional[int] = None,
+    ):
+        self.target_ms = target_ms
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self.queue_timeout = queue_timeout
+        self.fixed_rounds = rounds
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.set_rounds(rounds or DEFAULT_ROUNDS)
+
+    def set_rounds(self, rounds: int) -> None:
+        self.rounds = rounds
+        # min_rounds makes needs_update() flag weaker hashes; stronger ones are left alone
+        self.context.update(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds)
+        registry.set_gauge("eureka_password_hash_rounds", rounds)
+
+    def calibrate(self) -> int:
+        """Pick the cost for this host, unless one was configured explicitly"""
+        if self.fixed_rounds:
+            return self.rounds
+        rounds = calibrate_rounds(self.target_ms)
+        self.set_rounds(rounds)
+        logger.info("Password hashing calibrated to bcrypt cost %s (target %sms)", rounds, self.target_ms)
+        return rounds
+
+    async def _run(self, func, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        registry.add_gauge("eureka_pool_queue_depth", 1, pool="password_hash")
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            registry.inc("eureka_errors_total", stage="password_hash.busy")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many sign-in attempts in progress, try again shortly",
+                headers={"Retry-After": "1"}
+            )
+        finally:
+            registry.add_gauge("eureka_pool_queue_depth", -1, pool="password_hash")
+        try:
+            return await run_in_threadpool(func, *args)
+        finally:
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        """
+        Check a password; on success also returns a replacement hash when the
+        stored one is weaker than the current policy, else None.
+        """
+        return await self._run(self.context.verify_and_update, password, password_hash)
+
+
+password_service = PasswordService(
+    target_ms=float(os.getenv("PASSWORD_HASH_TARGET_MS", "250")),
+    concurrency=int(os.getenv("PASSWORD_HASH_CONCURRENCY", "0")) or None,
+    queue_timeout=float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "5")),
+    rounds=int(os.getenv("PASSWORD_HASH_ROUNDS", "0")) or None,
+)
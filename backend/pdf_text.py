@@ -0,0 +1,63 @@
+import io
+import logging
+import re
+import zlib
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # Fall back to the built-in content-stream scanner
+    PdfReader = None
+
+# pypdf warns on every malformed upload; those are expected and handled by the fallback
+logging.getLogger("pypdf").setLevel(logging.ERROR)
+
+STREAM_PATTERN = re.compile(rb"stream\r?\n(.*?)\r?\nendstream", re.S)
+# Strings shown with Tj / ' / " and the string parts of TJ arrays
+TEXT_PATTERN = re.compile(rb"\((?:\\.|[^\\)])*\)\s*(?:Tj|'|\")|\[(?:[^\]]*)\]\s*TJ")
+STRING_PATTERN = re.compile(rb"\(((?:\\.|[^\\)])*)\)")
+ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+
+
+def _unescape(raw: bytes) -> bytes:
+    def replace(match):
+        token = match.group(1)
+        if token in ESCAPES:
+            return ESCAPES[token]
+        if token.isdigit():
+            return bytes([int(token, 8) & 0xFF])
+        return token
+
+    return re.sub(rb"\\([0-7]{1,3}|.)", replace, raw, flags=re.S)
+
+
+def _scan_streams(data: bytes) -> str:
+    """Pull literal strings out of (possibly Flate-compressed) content streams"""
+    parts = []
+    for match in STREAM_PATTERN.finditer(data):
+        stream = match.group(1)
+        try:
+            stream = zlib.decompress(stream)
+        except zlib.error:
+            pass
+        for op in TEXT_PATTERN.finditer(stream):
+            for literal in STRING_PATTERN.findall(op.group(0)):
+                parts.append(_unescape(literal).decode("latin-1"))
+            parts.append(" ")
+        parts.append("\n")
+    return "".join(parts)
+
+
+def extract_text(data: bytes) -> str:
+    """
+    Extract the visible text of a PDF.
+
+    Uses pypdf when installed; otherwise scans content streams directly, which
+    handles the simple text layouts invoice generators produce.
+    """
+    if PdfReader is not None:
+        try:
+            reader = PdfReader(io.BytesIO(data))
+            return "\n".join(page.extract_text() or "" for page in reader.pages)
+        except Exception:
+            pass
+    return _scan_streams(data)
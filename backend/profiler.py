@@ -0,0 +1,157 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+# Frames whose leaf sits in these files are threads waiting for work, not doing it
+IDLE_FILES = ("selectors.py", "threading.py", "queue.py")
+
+# Threads worth sampling besides the event loop: the default executor workers
+WORKER_PREFIXES = ("ThreadPoolExecutor", "AnyIO worker")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    On-demand wall-clock sampler producing flamegraph collapsed stacks.
+
+    Nothing runs while it is disabled: the sampler thread only exists during a
+    session, and the middleware checks a single attribute per request.
+    """
+
+    def __init__(self):
+        self.active = False
+        self._lock = threading.Lock()
+        self._stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._route_prefix: Optional[str] = None
+        self._max_requests: Optional[int] = None
+        self._deadline: Optional[float] = None
+        self._interval = 0.005
+        self._in_flight = 0
+        self._completed = 0
+        self._samples = 0
+        self._started_at: Optional[float] = None
+        self._stopped_at: Optional[float] = None
+
+    def start(self, seconds: Optional[float] = None, requests: Optional[int] = None,
+              route: Optional[str] = None, interval: float = 0.005) -> None:
+        """Begin a session; must be called from the event loop thread"""
+        with self._lock:
+            if self.active:
+                raise RuntimeError("A profiling session is already running")
+            self._stacks = Counter()
+            self._loop_thread_id = threading.get_ident()
+            self._route_prefix = route
+            self._max_requests = requests
+            self._deadline = time.monotonic() + seconds if seconds else None
+            self._interval = interval
+            self._in_flight = 0
+            self._completed = 0
+            self._samples = 0
+            self._started_at = time.time()
+            self._stopped_at = None
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="eureka-profiler", daemon=True)
+            self.active = True
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            if not self.active:
+                return
+            self.active = False
+            self._stopped_at = time.time()
+            self._stop_event.set()
+
+    def matches(self, path: str) -> bool:
+        return self._route_prefix is None or path.startswith(self._route_prefix)
+
+    def request_started(self) -> None:
+        self._in_flight += 1
+
+    def request_finished(self) -> None:
+        self._in_flight -= 1
+        self._completed += 1
+        if self._max_requests and self._completed >= self._max_requests:
+            self.stop()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self._interval):
+            if self._deadline and time.monotonic() >= self._deadline:
+                self.stop()
+                break
+            # With a route filter, only sample while a matching request is in flight
+            if self._route_prefix is not None and self._in_flight <= 0:
+                continue
+            self._sample(own_id)
+
+    def _sample(self, own_id: int) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        collected = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            name = names.get(thread_id, "")
+            if thread_id != self._loop_thread_id and not name.startswith(WORKER_PREFIXES):
+                continue
+            if os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            root = "event-loop" if thread_id == self._loop_thread_id else "worker"
+            stack.append(root)
+            collected.append(";".join(reversed(stack)))
+        with self._lock:
+            self._stacks.update(collected)
+            self._samples += len(collected)
+
+    def status(self) -> dict:
+        return {
+            "active": self.active,
+            "route": self._route_prefix,
+            "max_requests": self._max_requests,
+            "completed_requests": self._completed,
+            "samples": self._samples,
+            "interval_ms": self._interval * 1000,
+            "started_at": self._started_at,
+            "stopped_at": self._stopped_at,
+        }
+
+    def collapsed(self) -> str:
+        """Render samples in the collapsed-stack format used by flamegraph.pl and speedscope"""
+        with self._lock:
+            stacks = dict(self._stacks)
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+profiler = SamplingProfiler()
+
+
+class ProfilerMiddleware:
+    """ASGI middleware that counts matching requests for an active profiling session"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not profiler.active or scope["type"] != "http" or not profiler.matches(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        profiler.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.request_finished()
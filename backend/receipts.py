@@ -0,0 +1,167 @@
+"""
+Signed verification receipts.
+
+A receipt is a compact JWS (ES256) over a stamped document's ID, SHA-256,
+upload timestamp, status and anchoring info (tx hash, block, Merkle proof
+when the submitter reports one). Anyone holding the public keys from
+``/receipts/keys`` can check a receipt against a local file with
+``verify_receipt.py``, without calling the backend again.
+
+Receipts expire ``RECEIPT_TTL_SECONDS`` (default one day) after issue and
+the verifier rejects them after that. A receipt only says what the status
+was when it was signed, so that is also the revocation window: a receipt
+issued before a stamp was revoked keeps verifying offline until it expires.
+
+The signing key is read from ``RECEIPT_SIGNING_KEY`` (PEM) or from
+``RECEIPT_KEY_FILE``; if neither exists a P-256 key is generated into the
+key file on first use, so every worker on the host signs with the same key.
+"""
+import base64
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+import orjson
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from jose import jwk, jws
+
+from metadata_store import PLACEHOLDER_HASH_PREFIXES
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = "ES256"
+RECEIPT_TYPE = "eureka-receipt+jws"
+RECEIPT_MEDIA_TYPE = "application/jose"
+ISSUER = os.getenv("RECEIPT_ISSUER", "eureka")
+RECEIPT_TTL = int(os.getenv("RECEIPT_TTL_SECONDS", "86400"))
+# A cached receipt is re-signed once this much of its lifetime has passed,
+# so one served from a cache still has most of its validity left
+REFRESH_FRACTION = 0.25
+# Most recently used receipts kept per worker
+RECEIPT_CACHE_SIZE = int(os.getenv("RECEIPT_CACHE_SIZE", "10000"))
+
+# Record fields copied into the receipt's "anchor" claim when present
+ANCHOR_FIELDS = ("tx_hash", "block_number", "merkle_root", "merkle_proof")
+
+
+def key_id(public_jwk: dict) -> str:
+    """RFC 7638 thumbprint of an EC public key"""
+    members = {name: public_jwk[name] for name in ("crv", "kty", "x", "y")}
+    digest = hashlib.sha256(orjson.dumps(members, option=orjson.OPT_SORT_KEYS)).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def load_or_create_key(path: Path) -> bytes:
+    """PEM private key from ``path``, generating it there if missing"""
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        pass
+    pem = ec.generate_private_key(ec.SECP256R1()).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    try:
+        # O_EXCL: if another worker got there first, use its key instead
+        fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return path.read_bytes()
+    with os.fdopen(fd, "wb") as f:
+        f.write(pem)
+    logger.info("Generated receipt signing key at %s", path)
+    return pem
+
+
+def receipt_claims(document: dict, issued_at: Optional[int] = None, ttl: int = RECEIPT_TTL) -> dict:
+    issued_at = int(time.time()) if issued_at is None else issued_at
+    claims = {
+        "iss": ISSUER,
+        "sub": document["id"],
+        "sha256": document["file_hash"],
+        "ts": document["timestamp"],
+        "status": document.get("status", "active"),
+        "ver": document.get("version", 1),
+        "iat": issued_at,
+        "exp": issued_at + ttl,
+    }
+    anchor = {name: document[name] for name in ANCHOR_FIELDS if document.get(name) is not None}
+    if anchor:
+        claims["anchor"] = anchor
+    return claims
+
+
+class ReceiptSigner:
+    def __init__(self, key_path: Path, pem: Optional[str] = None, ttl: int = RECEIPT_TTL,
+                 cache_size: int = RECEIPT_CACHE_SIZE):
+        self.key_path = Path(key_path)
+        self._pem = pem
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._key = None
+        self._kid: Optional[str] = None
+        self._jwks: Optional[dict] = None
+        # LRU of document id -> (version, issued at, token); signing costs far more than a lookup
+        self._cache: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _load(self) -> None:
+        with self._lock:
+            if self._key is not None:
+                return
+            pem = self._pem.encode() if self._pem else load_or_create_key(self.key_path)
+            key = jwk.construct(pem, ALGORITHM)
+            public = key.public_key().to_dict()
+            self._kid = key_id(public)
+            self._jwks = {"keys": [dict(public, kid=self._kid, use="sig", alg=ALGORITHM)]}
+            self._key = key
+
+    @property
+    def kid(self) -> str:
+        self._load()
+        return self._kid
+
+    def jwks(self) -> dict:
+        """Public keys for verifiers, as a JWK Set"""
+        self._load()
+        return self._jwks
+
+    def sign(self, document: dict) -> Tuple[str, str]:
+        """
+        Receipt for the current version of a document record, with its ETag.
+        The ETag changes with the record version, the signing key and each
+        re-signing; it is weak, since every worker signs its own bytes for
+        the same receipt.
+
+        Raises ValueError for placeholder records, which have no stored file
+        for a receipt to vouch for.
+        """
+        if document["file_hash"].startswith(PLACEHOLDER_HASH_PREFIXES):
+            raise ValueError(f"Document {document['id']} has no stored file")
+        self._load()
+        version = document.get("version", 1)
+        now = int(time.time())
+        with self._cache_lock:
+            cached = self._cache.get(document["id"])
+            if cached:
+                self._cache.move_to_end(document["id"])
+        if not (cached and cached[0] == version and now - cached[1] < self.ttl * REFRESH_FRACTION):
+            token = jws.sign(
+                receipt_claims(document, now, self.ttl),
+                self._key,
+                headers={"kid": self._kid, "typ": RECEIPT_TYPE},
+                algorithm=ALGORITHM,
+            )
+            cached = (version, now, token)
+            with self._cache_lock:
+                self._cache[document["id"]] = cached
+                self._cache.move_to_end(document["id"])
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        version, issued_at, token = cached
+        return token, f'W/"{document["id"]}.{version}.{issued_at}.{self._kid[:16]}"'
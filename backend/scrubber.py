@@ -0,0 +1,188 @@
+"""
+Background integrity scrubber for stored uploads.
+
+Re-hashes every stored blob in a low-priority process pool, throttled to a
+byte rate so it does not compete with request traffic for disk bandwidth,
+and compares it with the ``file_hash`` recorded in the metadata. Progress is
+checkpointed so a restarted scrub resumes where it left off.
+
+    python scrubber.py --rate-mb 20 --workers 2
+    python scrubber.py --loop --interval 86400
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from metadata_store import PLACEHOLDER_HASH_PREFIXES
+from tiering import open_blob
+
+CHUNK_SIZE = 1024 * 1024
+PLACEHOLDER_CONTENT = b"Placeholder file due to upload error"
+CHECKPOINT_EVERY = 50
+
+
+def _lower_priority() -> None:
+    """Pool initializer: run workers at the lowest CPU priority"""
+    try:
+        os.nice(19)
+    except (AttributeError, OSError):
+        pass
+
+
+def hash_file(path: str, bytes_per_second: float) -> str:
+    """
+    SHA-256 of a stored blob's original bytes, reading no faster than
+    ``bytes_per_second`` from disk. Archived blobs are decompressed on the fly.
+    """
+    sha256 = hashlib.sha256()
+    start = time.monotonic()
+    read = 0
+    with open(path, "rb") as f:
+        fd = f.fileno()
+        blob = open_blob(f)
+        while True:
+            chunk = blob.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            position = f.tell()
+            if hasattr(os, "posix_fadvise"):
+                # Drop scrubbed pages so they don't crowd request data out of the page cache
+                os.posix_fadvise(fd, read, position - read, os.POSIX_FADV_DONTNEED)
+            read = position
+            if bytes_per_second:
+                ahead = read / bytes_per_second - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+    return sha256.hexdigest()
+
+
+def scrub_document(document: dict, path: str, bytes_per_second: float) -> dict:
+    """Check one stored blob; runs in the pool"""
+    finding = {"id": document["id"], "file_path": document["file_path"], "expected": document["file_hash"]}
+    if document["file_hash"].startswith(PLACEHOLDER_HASH_PREFIXES):
+        return dict(finding, result="placeholder")
+    if path is None or not os.path.exists(path):
+        return dict(finding, result="missing")
+    try:
+        actual = hash_file(path, bytes_per_second)
+    except OSError as e:
+        return dict(finding, result="unreadable", error=str(e))
+    if actual == hashlib.sha256(PLACEHOLDER_CONTENT).hexdigest():
+        return dict(finding, result="placeholder", actual=actual)
+    if actual != document["file_hash"]:
+        return dict(finding, result="mismatch", actual=actual)
+    return dict(finding, result="ok")
+
+
+class Scrubber:
+    def __init__(self, store, resolve_path, state_dir: Path, workers: int = 2, rate_mb: float = 20.0):
+        self.store = store
+        self.resolve_path = resolve_path
+        self.checkpoint_path = Path(state_dir) / "scrub_checkpoint.json"
+        self.findings_path = Path(state_dir) / "scrub_findings.ndjson"
+        self.workers = workers
+        # Split the global rate limit evenly across workers
+        self.bytes_per_second = rate_mb * 1024 * 1024 / workers if rate_mb else 0
+
+    def _load_checkpoint(self) -> dict:
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_checkpoint(self, checkpoint: dict) -> None:
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _resolve(self, document: dict):
+        try:
+            return str(self.resolve_path(document["file_path"]))
+        except FileNotFoundError:
+            return None
+
+    def _record(self, document: dict, finding: dict) -> None:
+        finding["checked_at"] = datetime.now().isoformat()
+        if finding["result"] != "ok":
+            with open(self.findings_path, "a") as f:
+                f.write(json.dumps(finding) + "\n")
+        # Only touch the metadata when the verdict changes
+        previous = (document.get("integrity") or {}).get("result", "ok")
+        if finding["result"] != previous:
+            self.store.update(
+                document["id"],
+                integrity={"result": finding["result"], "checked_at": finding["checked_at"]}
+            )
+
+    def run(self) -> Counter:
+        """Scrub every document once, resuming from the last checkpoint"""
+        checkpoint = self._load_checkpoint()
+        if not checkpoint or checkpoint.get("finished_at"):
+            checkpoint = {"started_at": datetime.now().isoformat(), "next_index": 0, "counts": {}}
+        counts = Counter(checkpoint["counts"])
+        documents = self.store.all_documents()
+        next_index = checkpoint["next_index"]
+
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_lower_priority,
+        )
+        try:
+            # Bounded window, drained in submission order so the checkpoint is a clean prefix
+            pending = deque()
+            position = next_index
+            while position < len(documents) or pending:
+                while position < len(documents) and len(pending) < self.workers * 2:
+                    document = documents[position]
+                    pending.append(pool.submit(
+                        scrub_document, document, self._resolve(document), self.bytes_per_second
+                    ))
+                    position += 1
+                finding = pending.popleft().result()
+                counts[finding["result"]] += 1
+                self._record(documents[next_index], finding)
+                next_index += 1
+                if next_index % CHECKPOINT_EVERY == 0:
+                    self._save_checkpoint(dict(checkpoint, next_index=next_index, counts=counts))
+        finally:
+            pool.shutdown(wait=True)
+
+        self._save_checkpoint(dict(
+            checkpoint, next_index=next_index, counts=counts, finished_at=datetime.now().isoformat()
+        ))
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify stored uploads against their recorded SHA-256")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--rate-mb", type=float, default=20.0, help="total read rate limit in MB/s (0 = unlimited)")
+    parser.add_argument("--loop", action="store_true", help="keep scrubbing, one pass per interval")
+    parser.add_argument("--interval", type=float, default=86400.0, help="seconds between passes with --loop")
+    args = parser.parse_args()
+
+    from config import INDEX_DIR, open_document_store, resolve_upload_path
+
+    scrubber = Scrubber(open_document_store(), resolve_upload_path, INDEX_DIR, args.workers, args.rate_mb)
+    while True:
+        started = time.monotonic()
+        counts = scrubber.run()
+        print(f"Scrub finished: {dict(counts)}")
+        if not args.loop:
+            break
+        time.sleep(max(args.interval - (time.monotonic() - started), 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Near-duplicate invoice detection with MinHash signatures and banded LSH.
+
+Signatures and LSH buckets live in an indexed SQLite table next to the
+metadata, so the index is shared by all workers, costs no resident memory
+per document and can be rebuilt incrementally from stored uploads with
+``python similarity.py rebuild``.
+"""
+import argparse
+import random
+import re
+import sqlite3
+import threading
+import zlib
+from array import array
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional
+
+from metrics import registry
+from pdf_text import extract_text
+
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS  # Candidate threshold ~ (1/BANDS) ** (1/ROWS) ~= 0.71
+SHINGLE_SIZE = 3
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = 0xFFFFFFFF
+
+# Fixed seed: persisted signatures are only comparable under the same permutations
+_rng = random.Random(20250420)
+PERMUTATIONS = [
+    (_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingles(text: str) -> set:
+    """32-bit hashes of overlapping word n-grams"""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {zlib.crc32(" ".join(words).encode())} if words else set()
+    return {
+        zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode())
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def minhash(features: set) -> Optional[array]:
+    if not features:
+        return None
+    values = list(features)
+    return array("I", [
+        min([(a * x + b) % MERSENNE_PRIME for x in values]) & MAX_HASH
+        for a, b in PERMUTATIONS
+    ])
+
+
+def signature_for_text(text: str) -> Optional[array]:
+    return minhash(shingles(text))
+
+
+def signature_for_pdf(data: bytes) -> Optional[array]:
+    return signature_for_text(extract_text(data))
+
+
+def estimate_similarity(left, right) -> float:
+    return sum(1 for x, y in zip(left, right) if x == y) / NUM_PERM
+
+
+def _band_keys(signature) -> List[int]:
+    return [
+        hash((band, tuple(signature[band * ROWS:(band + 1) * ROWS])))
+        for band in range(BANDS)
+    ]
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    doc_id TEXT PRIMARY KEY,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    band_key INTEGER NOT NULL,
+    doc_id TEXT NOT NULL,
+    PRIMARY KEY (band_key, doc_id)
+) WITHOUT ROWID;
+"""
+
+
+def _decode(blob: bytes) -> array:
+    signature = array("I")
+    signature.frombytes(blob)
+    return signature
+
+
+class MinHashIndex:
+    """
+    LSH index over MinHash signatures.
+
+    Each document is one signature row (0.5 KB) plus one bucket row per band;
+    a query is ``BANDS`` primary-key lookups and a comparison against the
+    candidates they return, so neither memory nor query time grows with the
+    size of the index.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+
+    def add(self, doc_id: str, signature: array) -> None:
+        """Index a signature; a document already indexed keeps its first signature"""
+        with self._lock, self._conn:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO signatures (doc_id, signature) VALUES (?, ?)", (doc_id, signature.tobytes())
+            ).rowcount
+            if inserted:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO lsh_buckets (band_key, doc_id) VALUES (?, ?)",
+                    [(key, doc_id) for key in _band_keys(signature)],
+                )
+
+    def contains(self, doc_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM signatures WHERE doc_id = ?", (doc_id,)).fetchone() is not None
+
+    def signature(self, doc_id: str) -> Optional[array]:
+        with self._lock:
+            row = self._conn.execute("SELECT signature FROM signatures WHERE doc_id = ?", (doc_id,)).fetchone()
+        return None if row is None else _decode(row[0])
+
+    def query(self, signature, limit: int = 5, min_similarity: float = 0.5,
+              exclude: Optional[str] = None) -> List[dict]:
+        """Most similar indexed documents, found via shared LSH buckets"""
+        keys = _band_keys(signature)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, signature FROM signatures WHERE doc_id IN "
+                f"(SELECT doc_id FROM lsh_buckets WHERE band_key IN ({', '.join('?' * len(keys))}))",
+                keys,
+            ).fetchall()
+        matches = []
+        for doc_id, blob in rows:
+            if doc_id == exclude:
+                continue
+            score = estimate_similarity(signature, _decode(blob))
+            if score >= min_similarity:
+                matches.append({"id": doc_id, "similarity": round(score, 3)})
+        matches.sort(key=lambda match: match["similarity"], reverse=True)
+        return matches[:limit]
+
+    def sync(self, documents: Iterable[dict], read_blob: Callable[[dict], bytes]) -> int:
+        """Index any stored documents missing from the index; returns how many were added"""
+        added = 0
+        for document in documents:
+            if self.contains(document["id"]):
+                continue
+            try:
+                signature = signature_for_pdf(read_blob(document))
+            except Exception:
+                # One unreadable or malformed upload must not stop the rebuild
+                registry.inc("eureka_errors_total", stage="similarity_index")
+                continue
+            if signature is not None:
+                self.add(document["id"], signature)
+                added += 1
+        return added
+
+    def reset(self) -> None:
+        """Drop the index so the next sync rebuilds it from scratch"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM lsh_buckets")
+            self._conn.execute("DELETE FROM signatures")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the near-duplicate invoice index")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--full", action="store_true", help="discard the index and re-index everything")
+    args = parser.parse_args()
+
+    from config import MINHASH_INDEX_FILE, open_document_store, read_document_bytes
+
+    document_store = open_document_store()
+    similarity_index = MinHashIndex(MINHASH_INDEX_FILE)
+    if args.full:
+        similarity_index.reset()
+    added = similarity_index.sync(document_store.all_documents(), read_document_bytes)
+    print(f"Indexed {added} documents ({len(similarity_index)} total)")
+
+
+if __name__ == "__main__":
+    main()
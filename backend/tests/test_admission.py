@@ -0,0 +1,73 @@
+import pytest
+
+import admission
+from admission import MemoryBucketStore, SQLiteBucketStore
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    monkeypatch.setattr(admission.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path, clock):
+    if request.param == "memory":
+        return MemoryBucketStore()
+    return SQLiteBucketStore(str(tmp_path / "buckets.sqlite3"))
+
+
+def test_burst_then_limited(store):
+    assert [store.take("k", 1.0, 3.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert store.take("k", 1.0, 3.0) == pytest.approx(1.0)
+
+
+def test_refills_at_rate(store, clock):
+    for _ in range(2):
+        store.take("k", 2.0, 2.0)
+    assert store.take("k", 2.0, 2.0) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert store.take("k", 2.0, 2.0) == 0.0
+    assert store.take("k", 2.0, 2.0) > 0
+
+
+def test_refill_capped_at_burst(store, clock):
+    store.take("k", 1.0, 2.0)
+    clock.now += 3600
+    assert [store.take("k", 1.0, 2.0) for _ in range(2)] == [0.0, 0.0]
+    assert store.take("k", 1.0, 2.0) > 0
+
+
+def test_keys_are_independent(store):
+    store.take("a", 1.0, 1.0)
+    assert store.take("a", 1.0, 1.0) > 0
+    assert store.take("b", 1.0, 1.0) == 0.0
+
+
+def test_sqlite_buckets_shared_between_stores(tmp_path, clock):
+    path = str(tmp_path / "buckets.sqlite3")
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    assert first.take("k", 1.0, 1.0) == 0.0
+    assert second.take("k", 1.0, 1.0) > 0
+
+
+def test_refilled_buckets_are_purged(store, clock):
+    store.take("idle", 1.0, 2.0)
+    store.take("busy", 0.001, 2.0)
+    assert len(store) == 2
+    clock.now += admission.PURGE_INTERVAL + 1
+    store.take("new", 1.0, 2.0)
+    # "idle" refilled after a second and is gone; "busy" is still short of its burst
+    assert len(store) == 2
+    assert store.take("busy", 0.001, 2.0) == 0.0
+    assert store.take("busy", 0.001, 2.0) > 0
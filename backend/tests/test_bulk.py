@@ -0,0 +1,76 @@
+import orjson
+import pytest
+
+import bulk
+from benchmarks.fake_supabase import FakeSupabaseClient
+from bulk import Checkpoint, PostgrestTable
+from metadata_store import DocumentStore
+
+USER_1 = "00000000-0000-0000-0000-000000000001"
+USER_2 = "00000000-0000-0000-0000-000000000002"
+
+
+def write_ndjson(path, records):
+    path.write_bytes(b"".join(orjson.dumps(record) + b"\n" for record in records))
+    return path
+
+
+def read_errors(source):
+    path = source.with_name(source.name + ".errors.ndjson")
+    return [orjson.loads(line) for line in path.read_bytes().splitlines()] if path.exists() else []
+
+
+@pytest.fixture
+def client():
+    return FakeSupabaseClient()
+
+
+def test_postgrest_write_skips_existing_emails(client):
+    table = PostgrestTable(client, "users", None)
+    assert table.write([{"email": "a@example.com"}, {"email": "b@example.com"}]) == 2
+    # Replaying rows without ids must not insert the same accounts again
+    assert table.write([{"email": "a@example.com"}, {"email": "c@example.com"}]) == 1
+    assert sorted(row["email"] for row in client.tables["users"]) == ["a@example.com", "b@example.com", "c@example.com"]
+
+
+def test_import_table_rejects_bad_rows_and_continues(tmp_path, client, monkeypatch):
+    monkeypatch.setattr(bulk, "open_table", lambda table: PostgrestTable(client, table, None))
+    source = write_ndjson(tmp_path / "users.ndjson", [
+        {"email": "a@example.com", "name": "A"},
+        {"name": "No email"},
+        {"email": "a@example.com", "name": "A again"},
+        {"email": "b@example.com", "name": "B"},
+    ])
+    checkpoint = Checkpoint(tmp_path / "users.checkpoint.json", source)
+    counts = bulk.import_table("users", source, "ndjson", checkpoint, batch_size=2, workers=2)
+    assert counts == {"imported": 2, "duplicate": 1, "failed": 1}
+    assert [(item["line"], item["record"]) for item in read_errors(source)] == [(2, {"name": "No email"})]
+
+    # A rerun of the same file from the start imports nothing new
+    checkpoint.save(0)
+    counts = bulk.import_table("users", source, "ndjson", checkpoint, batch_size=2, workers=2)
+    assert counts["imported"] == 0
+    assert len(client.tables["users"]) == 2
+
+
+def test_import_documents_dedupes_within_batch(tmp_path, monkeypatch):
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    store = DocumentStore(tmp_path / "documents.json")
+    monkeypatch.setattr(bulk, "UPLOAD_DIR", uploads)
+    monkeypatch.setattr(bulk, "open_document_store", lambda: store)
+    files = tmp_path / "files"
+    files.mkdir()
+    (files / "a.pdf").write_bytes(b"%PDF-1.4 same")
+    (files / "b.pdf").write_bytes(b"%PDF-1.4 same")
+    source = write_ndjson(tmp_path / "documents.ndjson", [
+        {"user_id": USER_1, "user_email": "one@example.com", "source_path": "a.pdf"},
+        {"user_id": USER_1, "user_email": "one@example.com", "source_path": "b.pdf"},
+        {"user_id": USER_2, "user_email": "two@example.com", "source_path": "b.pdf"},
+    ])
+    checkpoint = Checkpoint(tmp_path / "documents.checkpoint.json", source)
+    counts = bulk.import_documents(source, "ndjson", checkpoint, batch_size=10, workers=1, files_dir=files)
+    assert counts == {"imported": 2, "duplicate": 1}
+    assert sorted(str(doc["user_id"]) for doc in store.all_documents()) == [USER_1, USER_2]
+    # The duplicate's copy is not left behind in uploads
+    assert len(list(uploads.iterdir())) == 2
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from downloads import BlobFileResponse, etag_matches, make_etag, parse_range
+
+
+@pytest.mark.parametrize("header, size, expected", [
+    (None, 100, None),
+    ("", 100, None),
+    ("bytes=0-9", 100, (0, 9)),
+    ("bytes=90-", 100, (90, 99)),
+    ("bytes=90-500", 100, (90, 99)),
+    ("bytes=-10", 100, (90, 99)),
+    ("bytes=-500", 100, (0, 99)),
+    ("bytes=5-5", 100, (5, 5)),
+    # Ignored: served as a full 200 response
+    ("bytes=5-2", 100, None),
+    ("bytes=0-1,5-6", 100, None),
+    ("items=0-1", 100, None),
+    ("bytes=-", 100, None),
+])
+def test_parse_range(header, size, expected):
+    assert parse_range(header, size) == expected
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=100-", 100),
+    ("bytes=100-200", 100),
+    ("bytes=-0", 100),
+    ("bytes=-5", 0),
+    ("bytes=0-", 0),
+])
+def test_parse_range_not_satisfiable(header, size):
+    with pytest.raises(ValueError):
+        parse_range(header, size)
+
+
+def test_etag_matches():
+    etag = make_etag("abc")
+    assert etag == '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"other", "abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"abd"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("", etag)
+
+
+def test_etag_matches_weak_etag():
+    assert etag_matches('"a.1"', 'W/"a.1"')
+    assert etag_matches('W/"a.1"', 'W/"a.1"')
+    assert not etag_matches('W/"a.2"', 'W/"a.1"')
+
+
+def serve(response, method="GET"):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": method, "headers": [], "extensions": {}}
+    asyncio.run(response(scope, receive, send))
+    return messages[0]["status"], b"".join(m.get("body", b"") for m in messages[1:])
+
+
+def test_blob_file_response_range(tmp_path):
+    path = tmp_path / "blob.pdf"
+    path.write_bytes(b"0123456789")
+    status, body = serve(BlobFileResponse(path, 10, make_etag("h"), "application/pdf", byte_range=(2, 5)))
+    assert (status, body) == (206, b"2345")
+    status, body = serve(BlobFileResponse(path, 10, make_etag("h"), "application/pdf"), method="HEAD")
+    assert (status, body) == (200, b"")
+
+
+def test_blob_file_response_missing_file(tmp_path):
+    response = BlobFileResponse(tmp_path / "gone.pdf", 10, make_etag("h"), "application/pdf")
+    status, _ = serve(response)
+    assert status == 404
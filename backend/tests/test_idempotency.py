@@ -0,0 +1,47 @@
+import pytest
+
+import idempotency
+from idempotency import IdempotencyStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(tmp_path / "idempotency.sqlite3", ttl=3600)
+
+
+def test_first_request_reserves_the_key(store):
+    assert store.reserve("user-1", "k", "hash-a") is None
+    # A concurrent retry sees the reservation, without a response yet
+    assert store.reserve("user-1", "k", "hash-a") == {"file_hash": "hash-a", "response": None}
+    store.put("user-1", "k", "hash-a", {"id": "INV-1"})
+    assert store.reserve("user-1", "k", "hash-a") == {"file_hash": "hash-a", "response": {"id": "INV-1"}}
+    # Keys are per user
+    assert store.reserve("user-2", "k", "hash-b") is None
+
+
+def test_release_frees_the_key(store):
+    store.reserve("user-1", "k", "hash-a")
+    store.release("user-1", "k")
+    assert store.reserve("user-1", "k", "hash-b") is None
+
+
+def test_release_keeps_recorded_outcomes(store):
+    store.reserve("user-1", "k", "hash-a")
+    store.put("user-1", "k", "hash-a", {"id": "INV-1"})
+    store.release("user-1", "k")
+    assert store.reserve("user-1", "k", "hash-a")["response"] == {"id": "INV-1"}
+    store.delete("user-1", "k")
+    assert store.reserve("user-1", "k", "hash-a") is None
+
+
+def test_abandoned_and_expired_records_are_taken_over(store, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(idempotency.time, "time", lambda: now[0])
+    store.reserve("user-1", "pending", "hash-a")
+    store.reserve("user-1", "done", "hash-a")
+    store.put("user-1", "done", "hash-a", {"id": "INV-1"})
+    now[0] += store.pending_timeout + 1
+    assert store.reserve("user-1", "pending", "hash-b") is None
+    assert store.reserve("user-1", "done", "hash-a")["response"] == {"id": "INV-1"}
+    now[0] += store.ttl
+    assert store.reserve("user-1", "done", "hash-b") is None
@@ -0,0 +1,85 @@
+import pytest
+
+from invoice_fields import FieldIndex, iban_is_valid, parse_invoice_fields, payee_key
+
+INVOICE = """
+Bench Supplies Ltd
+Invoice No: INV-4456
+Account name: Bench Supplies Ltd
+Sort code: 40-63-84 Account number: 89615010
+IBAN: GB82 WEST 1234 5698 7654 32
+Total due: GBP 4,147.00
+"""
+
+
+def test_parse_invoice_fields():
+    assert parse_invoice_fields(INVOICE) == {
+        "invoice_number": "INV-4456",
+        "amount": 4147.0,
+        "currency": "GBP",
+        "payee": "Bench Supplies Ltd",
+        "iban": "GB82WEST12345698765432",
+        "sort_code": "406384",
+        "account_number": "89615010",
+    }
+
+
+def test_parse_invoice_fields_skips_invalid_iban():
+    fields = parse_invoice_fields("IBAN: GB00 WEST 1234 5698 7654 32\nAmount due £12.50")
+    assert fields["iban"] is None
+    assert (fields["amount"], fields["currency"]) == (12.5, "GBP")
+
+
+@pytest.mark.parametrize("iban, valid", [
+    ("GB82WEST12345698765432", True),
+    ("DE89370400440532013000", True),
+    ("GB83WEST12345698765432", False),
+    ("DE89370400440532013001", False),
+])
+def test_iban_is_valid(iban, valid):
+    assert iban_is_valid(iban) is valid
+
+
+@pytest.mark.parametrize("name, key", [
+    ("Acme Ltd", "acme"),
+    ("ACME LIMITED", "acme"),
+    ("Acme Widgets Co. Ltd", "acme widgets"),
+    ("Limited Edition Prints plc", "limited edition prints"),
+    ("Ltd", None),
+    (None, None),
+])
+def test_payee_key(name, key):
+    assert payee_key(name) == key
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = FieldIndex(tmp_path / "fields.sqlite3")
+    uk = lambda account: {"payee": "Acme Ltd", "sort_code": "112233", "account_number": account}
+    index.upsert("INV-1", "user-1", uk("11111111"))
+    index.upsert("INV-2", "user-1", uk("22222222"))
+    index.upsert("INV-3", "user-2", uk("22222222"))
+    index.upsert("INV-4", "user-2", {"payee": "ACME LIMITED"})
+    return index
+
+
+def test_payee_mismatches_splits_own_and_other(index):
+    own, other = index.payee_mismatches(
+        "ACME LIMITED", "user-1", {"sort_code": "112233", "account_number": "11111111"}
+    )
+    assert [row["doc_id"] for row in own] == ["INV-2"]
+    assert other == 1
+
+
+def test_payee_mismatches_without_bank_details(index):
+    # More than one set of bank details seen for the payee: every invoice with details matches
+    own, other = index.payee_mismatches("Acme", "user-1")
+    assert sorted(row["doc_id"] for row in own) == ["INV-1", "INV-2"]
+    assert other == 1
+
+
+def test_payee_mismatches_without_bank_details_consistent_payee(tmp_path):
+    index = FieldIndex(tmp_path / "fields.sqlite3")
+    for doc_id in ("INV-1", "INV-2"):
+        index.upsert(doc_id, "user-1", {"payee": "Acme Ltd", "iban": "GB82WEST12345698765432"})
+    assert index.payee_mismatches("Acme", "user-1") == ([], 0)
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+
+import orjson
+
+from logging_setup import (
+    ContextFilter, JsonFormatter, RequestIdMiddleware, SamplingFilter, _parse_levels, request_id_var,
+)
+
+
+def make_record(msg="hello", **extra):
+    record = logging.LogRecord("main", logging.WARNING, __file__, 1, msg, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_sampling_keeps_one_in_n():
+    sampling = SamplingFilter()
+    records = [make_record(sample=3) for _ in range(7)]
+    assert [sampling.filter(record) for record in records] == [True, False, False, True, False, False, True]
+    assert records[3].sampled == 3
+    # Records without a sample rate always pass
+    assert sampling.filter(make_record())
+
+
+def test_json_lines_carry_request_id():
+    record = make_record("upload %s", request_id=None)
+    record.args = ("INV-1",)
+    token = request_id_var.set("abc123")
+    try:
+        ContextFilter().filter(record)
+    finally:
+        request_id_var.reset(token)
+    entry = orjson.loads(JsonFormatter().format(record))
+    assert (entry["level"], entry["logger"], entry["msg"], entry["request_id"]) == ("WARNING", "main", "upload INV-1", "abc123")
+
+
+def test_parse_levels():
+    assert _parse_levels("auth=warning, metadata_store=DEBUG,bogus") == {"auth": "WARNING", "metadata_store": "DEBUG"}
+
+
+def test_request_id_middleware_propagates_and_assigns():
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(request_id_var.get())
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    async def call(headers):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        await RequestIdMiddleware(app)({"type": "http", "headers": headers}, None, send)
+        return dict(messages[0]["headers"])[b"x-request-id"].decode()
+
+    assert asyncio.run(call([(b"x-request-id", b"from-client")])) == "from-client"
+    generated = asyncio.run(call([]))
+    assert len(generated) == 32
+    assert seen == ["from-client", generated]
+    assert request_id_var.get() is None
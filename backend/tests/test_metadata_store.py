@@ -0,0 +1,97 @@
+import itertools
+
+import pytest
+
+import metadata_store
+from metadata_store import DocumentStore
+
+
+def record(document_id, user_id="user-1", file_hash=None):
+    return {"id": document_id, "user_id": user_id, "file_hash": file_hash or f"hash-{document_id}", "status": "active"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return DocumentStore(tmp_path / "documents.json")
+
+
+def test_versions_and_document_etag(store):
+    added = store.append(record("INV-0001"))
+    assert added["version"] == 1
+    assert store.document_etag(added) == '"INV-0001.1"'
+
+    updated = store.update("INV-0001", status="anchored")
+    assert updated["version"] == 2
+    assert updated["status"] == "anchored"
+    assert store.document_etag(updated) == '"INV-0001.2"'
+    assert store.find("INV-0001") is updated
+
+
+def test_user_etag_changes_on_writes(store):
+    empty = store.user_etag("user-1")
+    store.append(record("INV-0001"))
+    after_append = store.user_etag("user-1")
+    store.update("INV-0001", status="revoked")
+    after_update = store.user_etag("user-1")
+    assert len({empty, after_append, after_update}) == 3
+    # Other users' writes leave it alone
+    store.append(record("INV-0002", user_id="user-2"))
+    assert store.user_etag("user-1") == after_update
+
+
+def test_etags_agree_across_instances(tmp_path, monkeypatch):
+    monkeypatch.setattr(metadata_store, "STAT_INTERVAL", 0)
+    path = tmp_path / "documents.json"
+    first, second = DocumentStore(path), DocumentStore(path)
+    first.append(record("INV-0001"))
+    first.update("INV-0001", status="anchored")
+    assert second.user_etag("user-1") == first.user_etag("user-1")
+    assert second.document_etag(second.find("INV-0001")) == '"INV-0001.2"'
+
+    # A write through the second instance builds on the first's changes
+    second.append(record("INV-0002"))
+    assert [doc["id"] for doc in first.user_documents("user-1")] == ["INV-0001", "INV-0002"]
+
+
+def test_serialized_cached_per_version(store):
+    document = store.append(record("INV-0001"))
+    assert store.serialized(document) is store.serialized(document)
+    updated = store.update("INV-0001", status="anchored")
+    assert b'"anchored"' in store.serialized(updated)
+
+
+def test_append_reuses_cached_serializations(store, monkeypatch):
+    store.extend([record(f"INV-{i:04d}") for i in range(100)])
+    for document in store.all_documents():
+        store.serialized(document)
+    calls = []
+    dumps = metadata_store.orjson.dumps
+    monkeypatch.setattr(metadata_store.orjson, "dumps", lambda *a, **k: calls.append(1) or dumps(*a, **k))
+    store.append(record("INV-NEW"))
+    # Normalising the new record and serializing it; the others come from the cache
+    assert len(calls) == 2
+
+
+def test_listeners_see_added_and_updated_records(store):
+    seen = []
+    store.add_listener(lambda doc: seen.append((doc["id"], doc["version"])))
+    store.append(record("INV-0001"))
+    store.extend([record("INV-0002")])
+    store.update("INV-0001", status="anchored")
+    assert seen == [("INV-0001", 1), ("INV-0002", 1), ("INV-0001", 2)]
+
+
+def test_extend_skips_known_ids(store):
+    store.append(record("INV-0001"))
+    added = store.extend([record("INV-0001"), record("INV-0002")])
+    assert [doc["id"] for doc in added] == ["INV-0002"]
+    assert len(store.all_documents()) == 2
+
+
+def test_extend_assigns_unused_ids(store):
+    store.append(record("INV-0001"))
+    ids = itertools.cycle(["INV-0001", "INV-0002", "INV-0003"])
+    added = store.extend([record(None), record(None)], new_id=lambda: next(ids))
+    assert [(doc["id"], doc["name"]) for doc in added] == [
+        ("INV-0002", "INV-0002.pdf"), ("INV-0003", "INV-0003.pdf")
+    ]
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from metrics import MetricsMiddleware, MetricsRegistry, cache_hit, registry, stage
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    registry.reset()
+    yield
+    registry.reset()
+
+
+def test_counters_gauges_and_histograms_render():
+    metrics = MetricsRegistry()
+    metrics.describe("jobs_total", "counter", "Jobs run")
+    metrics.inc("jobs_total", kind="a")
+    metrics.inc("jobs_total", 2, kind="a")
+    metrics.add_gauge("queue_depth", 3)
+    metrics.add_gauge("queue_depth", -1)
+    metrics.observe("latency_seconds", 0.003)
+    metrics.observe("latency_seconds", 20.0)
+    lines = metrics.render().splitlines()
+    assert "# HELP jobs_total Jobs run" in lines
+    assert 'jobs_total{kind="a"} 3' in lines
+    assert "queue_depth 2" in lines
+    assert 'latency_seconds_bucket{le="0.0025"} 0' in lines
+    assert 'latency_seconds_bucket{le="0.005"} 1' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in lines
+    assert "latency_seconds_count 2" in lines
+
+
+def test_stage_times_and_counts_errors():
+    with stage("ok"):
+        pass
+    with pytest.raises(ValueError):
+        with stage("broken"):
+            raise ValueError("boom")
+    rendered = registry.render()
+    assert 'eureka_stage_duration_seconds_count{stage="ok"} 1' in rendered
+    assert 'eureka_stage_duration_seconds_count{stage="broken"} 1' in rendered
+    assert 'eureka_errors_total{stage="broken"} 1' in rendered
+    assert 'eureka_errors_total{stage="ok"}' not in rendered
+
+
+def test_cache_counters():
+    cache_hit("documents_etag")
+    cache_hit("documents_etag")
+    assert 'eureka_cache_hits_total{cache="documents_etag"} 2' in registry.render()
+
+
+def test_middleware_records_route_and_status():
+    async def get_documents(scope, receive, send):
+        scope["endpoint"] = get_documents
+        await send({"type": "http.response.start", "status": 503, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def run():
+        async def receive():
+            return {"type": "http.request"}
+
+        async def send(message):
+            pass
+
+        await MetricsMiddleware(get_documents)({"type": "http", "method": "GET"}, receive, send)
+
+    asyncio.run(run())
+    rendered = registry.render()
+    assert 'eureka_request_duration_seconds_count{method="GET",route="get_documents",status="503"} 1' in rendered
+    assert 'eureka_errors_total{route="get_documents"} 1' in rendered
+    assert "eureka_requests_in_flight 0" in rendered
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from passwords import PasswordService, calibrate_rounds
+
+
+def bcrypt_hash(password, rounds):
+    return CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds).hash(password)
+
+
+def cost(password_hash):
+    return int(password_hash.split("$")[2])
+
+
+def test_hash_uses_configured_rounds():
+    service = PasswordService(rounds=5)
+    assert cost(asyncio.run(service.hash("secret"))) == 5
+
+
+def test_weaker_hash_upgraded_on_login():
+    service = PasswordService(rounds=5)
+    ok, new_hash = asyncio.run(service.verify_and_update("secret", bcrypt_hash("secret", 4)))
+    assert ok and cost(new_hash) == 5
+    assert asyncio.run(service.verify_and_update("secret", new_hash)) == (True, None)
+
+
+def test_stronger_hash_and_wrong_password_left_alone():
+    service = PasswordService(rounds=4)
+    stronger = bcrypt_hash("secret", 5)
+    assert asyncio.run(service.verify_and_update("secret", stronger)) == (True, None)
+    assert asyncio.run(service.verify_and_update("wrong", stronger)) == (False, None)
+
+
+def test_calibration_clamped():
+    assert calibrate_rounds(0.001, min_rounds=4, max_rounds=16) == 4
+    assert calibrate_rounds(10 ** 9, min_rounds=4, max_rounds=6) == 6
+
+
+def test_fixed_rounds_skip_calibration():
+    service = PasswordService(rounds=5)
+    assert service.calibrate() == 5
+
+
+def test_busy_service_answers_503():
+    service = PasswordService(rounds=4, concurrency=1, queue_timeout=0.05)
+
+    async def run():
+        await service._run(lambda: None)
+        # Every hashing slot taken
+        await service._semaphore.acquire()
+        with pytest.raises(HTTPException) as error:
+            await service.hash("secret")
+        return error.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == "1"
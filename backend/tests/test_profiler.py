@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from profiler import SamplingProfiler
+
+
+def spin(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+@pytest.fixture
+def profiler():
+    profiler = SamplingProfiler()
+    yield profiler
+    profiler.stop()
+
+
+def test_samples_the_calling_thread(profiler):
+    profiler.start(seconds=5, interval=0.001)
+    spin(0.2)
+    profiler.stop()
+    status = profiler.status()
+    assert not status["active"] and status["samples"] > 0
+    lines = profiler.collapsed().splitlines()
+    assert any(line.startswith("event-loop;") and "spin (test_profiler.py" in line for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+
+def test_one_session_at_a_time(profiler):
+    profiler.start(seconds=5)
+    with pytest.raises(RuntimeError):
+        profiler.start(seconds=5)
+
+
+def test_stops_after_request_budget(profiler):
+    profiler.start(requests=2)
+    for _ in range(2):
+        profiler.request_started()
+        profiler.request_finished()
+    assert not profiler.active
+    assert profiler.status()["completed_requests"] == 2
+
+
+def test_stops_at_deadline(profiler):
+    profiler.start(seconds=0.05, interval=0.001)
+    deadline = time.monotonic() + 2
+    while profiler.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not profiler.active
+
+
+def test_route_filter(profiler):
+    profiler.start(seconds=5, route="/upload", interval=0.001)
+    assert profiler.matches("/upload")
+    assert not profiler.matches("/documents")
+    # Nothing is sampled while no matching request is in flight
+    spin(0.05)
+    assert profiler.status()["samples"] == 0
@@ -0,0 +1,90 @@
+import hashlib
+import json
+
+import pytest
+from jose.utils import base64url_decode, base64url_encode
+
+from receipts import ReceiptSigner
+from verify_receipt import LEEWAY, ReceiptError, ReceiptVerifier
+
+CONTENT = b"%PDF-1.4 stamped invoice"
+
+
+def document(document_id="INV-0001-0001", version=1, **fields):
+    return dict({
+        "id": document_id,
+        "file_hash": hashlib.sha256(CONTENT).hexdigest(),
+        "timestamp": "2025-04-20T10:00:00",
+        "status": "active",
+        "version": version,
+    }, **fields)
+
+
+@pytest.fixture
+def signer(tmp_path):
+    return ReceiptSigner(tmp_path / "receipt_key.pem")
+
+
+@pytest.fixture
+def verifier(signer):
+    return ReceiptVerifier(signer.jwks())
+
+
+def test_sign_and_verify(signer, verifier, tmp_path):
+    file = tmp_path / "invoice.pdf"
+    file.write_bytes(CONTENT)
+    token, etag = signer.sign(document(tx_hash="0xabc"))
+    claims = verifier.verify(token, file)
+    assert (claims["sub"], claims["status"], claims["anchor"]) == ("INV-0001-0001", "active", {"tx_hash": "0xabc"})
+    assert etag.startswith('W/"INV-0001-0001.1.')
+
+    file.write_bytes(CONTENT + b" edited")
+    with pytest.raises(ReceiptError):
+        verifier.verify(token, file)
+
+
+def test_expired_receipt_rejected(signer, verifier):
+    token, _ = signer.sign(document())
+    claims = verifier.verify(token)
+    assert verifier.verify(token, now=claims["exp"] + LEEWAY)
+    with pytest.raises(ReceiptError, match="expired"):
+        verifier.verify(token, now=claims["exp"] + LEEWAY + 1)
+
+
+def test_tampered_receipt_rejected(signer, verifier):
+    token, _ = signer.sign(document())
+    header, payload, signature = token.split(".")
+    claims = json.loads(base64url_decode(payload.encode()))
+    claims["status"] = "anchored"
+    forged = ".".join([header, base64url_encode(json.dumps(claims).encode()).decode(), signature])
+    with pytest.raises(ReceiptError, match="Invalid signature"):
+        verifier.verify(forged)
+
+
+def test_revoked_receipt_rejected_unless_allowed(signer, verifier):
+    token, _ = signer.sign(document(status="revoked"))
+    with pytest.raises(ReceiptError):
+        verifier.verify(token)
+    assert verifier.verify(token, allow_revoked=True)["status"] == "revoked"
+
+
+@pytest.mark.parametrize("file_hash", ["error-1234", "emergency-1234"])
+def test_placeholder_hashes_not_signed(signer, file_hash):
+    with pytest.raises(ValueError):
+        signer.sign(document(file_hash=file_hash))
+
+
+def test_cached_until_version_changes(signer):
+    first = signer.sign(document())
+    assert signer.sign(document()) == first
+    assert signer.sign(document(version=2))[0] != first[0]
+
+
+def test_cache_keeps_most_recently_used(tmp_path):
+    signer = ReceiptSigner(tmp_path / "receipt_key.pem", cache_size=2)
+    first = signer.sign(document("INV-1"))
+    signer.sign(document("INV-2"))
+    signer.sign(document("INV-1"))
+    signer.sign(document("INV-3"))
+    assert list(signer._cache) == ["INV-1", "INV-3"]
+    assert signer.sign(document("INV-1")) == first
@@ -0,0 +1,61 @@
+import hashlib
+import json
+from pathlib import Path
+
+import pytest
+
+from metadata_store import DocumentStore
+from scrubber import PLACEHOLDER_CONTENT, Scrubber, hash_file, scrub_document
+from tiering import compress_blob
+
+CONTENT = b"%PDF-1.4 stored invoice\n" * 100
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+
+def stored(tmp_path, name, content=CONTENT):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return path
+
+
+def document(path, file_hash=CONTENT_HASH, document_id="INV-1"):
+    return {"id": document_id, "user_id": "user-1", "file_path": str(path), "file_hash": file_hash, "status": "active"}
+
+
+def test_hash_file_reads_both_tiers(tmp_path):
+    path = stored(tmp_path, "a.pdf")
+    archive = tmp_path / "a.pdf.zst"
+    compress_blob(path, archive, CONTENT_HASH, level=3)
+    assert hash_file(str(path), 0) == hash_file(str(archive), 0) == CONTENT_HASH
+
+
+@pytest.mark.parametrize("content, file_hash, result", [
+    (CONTENT, CONTENT_HASH, "ok"),
+    (CONTENT + b"tampered", CONTENT_HASH, "mismatch"),
+    (PLACEHOLDER_CONTENT, CONTENT_HASH, "placeholder"),
+    (CONTENT, "error-1234", "placeholder"),
+])
+def test_scrub_document(tmp_path, content, file_hash, result):
+    path = stored(tmp_path, "a.pdf", content)
+    assert scrub_document(document(path, file_hash), str(path), 0)["result"] == result
+
+
+def test_scrub_document_missing(tmp_path):
+    path = tmp_path / "gone.pdf"
+    assert scrub_document(document(path), str(path), 0)["result"] == "missing"
+    assert scrub_document(document(path), None, 0)["result"] == "missing"
+
+
+def test_run_records_findings(tmp_path):
+    store = DocumentStore(tmp_path / "documents.json")
+    store.append(document(stored(tmp_path, "ok.pdf"), document_id="INV-1"))
+    store.append(document(stored(tmp_path, "bad.pdf", b"tampered"), document_id="INV-2"))
+    scrubber = Scrubber(store, Path, tmp_path, workers=1, rate_mb=0)
+    counts = scrubber.run()
+    assert counts == {"ok": 1, "mismatch": 1}
+    assert "integrity" not in store.find("INV-1")
+    assert store.find("INV-2")["integrity"]["result"] == "mismatch"
+    findings = [json.loads(line) for line in scrubber.findings_path.read_text().splitlines()]
+    assert [(f["id"], f["result"]) for f in findings] == [("INV-2", "mismatch")]
+    # A finished scrub starts over on the next run
+    assert json.loads(scrubber.checkpoint_path.read_text())["finished_at"]
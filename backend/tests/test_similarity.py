@@ -0,0 +1,57 @@
+import pytest
+
+from metrics import registry
+from similarity import MinHashIndex, minhash, shingles
+
+TEXT = "Invoice INV-4456 from Bench Supplies Ltd for office chairs, desks and filing cabinets delivered in March"
+
+
+def signature(text):
+    return minhash(shingles(text))
+
+
+@pytest.fixture
+def index(tmp_path):
+    return MinHashIndex(tmp_path / "minhash.sqlite3")
+
+
+def test_query_finds_near_duplicates(index):
+    index.add("INV-0001", signature(TEXT))
+    index.add("INV-0002", signature("Completely unrelated text about a garden party and a string quartet"))
+    matches = index.query(signature(TEXT.replace("March", "April")), min_similarity=0.5)
+    assert [match["id"] for match in matches] == ["INV-0001"]
+    assert index.query(signature(TEXT), exclude="INV-0001") == []
+
+
+def test_add_keeps_first_signature(index):
+    first = signature(TEXT)
+    index.add("INV-0001", first)
+    index.add("INV-0001", signature("something else entirely, with enough words to shingle"))
+    assert len(index) == 1
+    assert index.signature("INV-0001") == first
+    assert index.signature("INV-0002") is None
+
+
+def test_index_shared_between_instances(tmp_path):
+    path = tmp_path / "minhash.sqlite3"
+    first, second = MinHashIndex(path), MinHashIndex(path)
+    first.add("INV-0001", signature(TEXT))
+    assert second.contains("INV-0001")
+    assert [match["id"] for match in second.query(signature(TEXT))] == ["INV-0001"]
+
+
+def test_sync_counts_failures_and_continues(index):
+    registry.reset()
+    documents = [{"id": "INV-0001"}, {"id": "INV-0002"}, {"id": "INV-0003"}]
+    blobs = {"INV-0001": b"not a pdf", "INV-0003": b"(" + TEXT.encode() + b")"}
+
+    def read_blob(document):
+        if document["id"] == "INV-0002":
+            raise RuntimeError("corrupt archive")
+        return blobs[document["id"]]
+
+    index.sync(documents, read_blob)
+    assert 'eureka_errors_total{stage="similarity_index"} 1' in registry.render()
+
+    index.reset()
+    assert len(index) == 0
@@ -0,0 +1,41 @@
+import hashlib
+import io
+
+import pytest
+
+from tiering import compress_blob, is_archived, open_blob, read_blob
+
+
+@pytest.fixture
+def blob(tmp_path):
+    data = b"%PDF-1.4\n" + b"invoice line item\n" * 5000
+    path = tmp_path / "blob.pdf"
+    path.write_bytes(data)
+    return path, data, hashlib.sha256(data).hexdigest()
+
+
+def test_compress_read_round_trip(blob, tmp_path):
+    path, data, file_hash = blob
+    archive = tmp_path / "blob.pdf.zst"
+    stored = compress_blob(path, archive, file_hash, level=3)
+    assert is_archived(archive)
+    assert stored == archive.stat().st_size < len(data)
+    assert read_blob(archive) == data
+    with open(archive, "rb") as f:
+        assert open_blob(f).read() == data
+    # The hot tier reads straight through
+    assert read_blob(path) == data
+
+
+def test_compress_rejects_hash_mismatch(blob, tmp_path):
+    path, _, _ = blob
+    archive = tmp_path / "blob.pdf.zst"
+    with pytest.raises(ValueError):
+        compress_blob(path, archive, "0" * 64, level=3)
+    assert not archive.exists()
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_open_blob_passes_hot_files_through():
+    raw = io.BytesIO(b"plain")
+    assert open_blob(raw) is raw
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent.parent / "benchmarks"
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    sys.path.insert(0, str(BENCHMARKS_DIR))
+    import run_benchmarks
+
+    cwd = os.getcwd()
+    main, _ = run_benchmarks.boot_app(tmp_path_factory.mktemp("app"), 0)
+    # Extraction runs in a process pool; not what these tests are about
+    original = main.extract_document_fields
+    main.extract_document_fields = lambda *args: None
+    yield main
+    main.extract_document_fields = original
+    os.chdir(cwd)
+
+
+def upload(main, *requests):
+    """POST each (content, headers) pair to /upload concurrently; returns the responses in order"""
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(
+                client.post("/upload", files={"file": ("invoice.pdf", content, "application/pdf")}, headers=headers)
+                for content, headers in requests
+            ))
+    return asyncio.run(run())
+
+
+def pdf():
+    return b"%PDF-1.4 invoice " + uuid.uuid4().bytes
+
+
+def test_key_replay(main):
+    content, key = pdf(), {"Idempotency-Key": str(uuid.uuid4())}
+    count = len(main.document_store.all_documents())
+    (first,) = upload(main, (content, key))
+    (retry,) = upload(main, (content, key))
+    assert first.status_code == retry.status_code == 200
+    assert retry.json()["id"] == first.json()["id"]
+    assert "idempotent-replayed" not in first.headers
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert len(main.document_store.all_documents()) == count + 1
+
+
+def test_key_reused_for_different_bytes(main):
+    key = {"Idempotency-Key": str(uuid.uuid4())}
+    upload(main, (pdf(), key))
+    (response,) = upload(main, (pdf(), key))
+    assert response.status_code == 422
+
+
+def test_same_bytes_answered_from_hash(main):
+    content = pdf()
+    count = len(main.document_store.all_documents())
+    first, again = upload(main, (content, {})), upload(main, (content, {}))
+    assert again[0].json()["id"] == first[0].json()["id"]
+    assert again[0].headers["idempotent-replayed"] == "true"
+    assert len(main.document_store.all_documents()) == count + 1
+
+
+def test_replay_shows_current_status(main):
+    content, key = pdf(), {"Idempotency-Key": str(uuid.uuid4())}
+    (first,) = upload(main, (content, key))
+    main.document_store.update(first.json()["id"], status="revoked")
+    (retry,) = upload(main, (content, key))
+    assert retry.json()["id"] == first.json()["id"]
+    assert retry.json()["status"] == "revoked"
+
+
+def test_concurrent_retries_store_once(main):
+    content, key = pdf(), {"Idempotency-Key": str(uuid.uuid4())}
+    count = len(main.document_store.all_documents())
+    responses = upload(main, *[(content, key)] * 4)
+    assert [r.status_code for r in responses] == [200] * 4
+    assert len({r.json()["id"] for r in responses}) == 1
+    assert len(main.document_store.all_documents()) == count + 1
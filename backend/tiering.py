@@ -0,0 +1,232 @@
+"""
+Compressed archive tier for aged uploads.
+
+Documents older than ``--min-age-days`` are zstd-compressed one blob per file
+into ``uploads/archive/`` and their metadata is pointed at the ``.zst`` file
+(``storage_tier: "archive"``). ``file_hash`` is left untouched and always
+refers to the original bytes; readers go through ``read_blob`` /
+``open_blob`` and never need to know which tier a document is on.
+
+    python tiering.py archive --min-age-days 90
+    python tiering.py report
+"""
+import argparse
+import hashlib
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+import zstandard
+
+from metadata_store import PLACEHOLDER_HASH_PREFIXES
+
+ARCHIVE_SUFFIX = ".zst"
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_LEVEL = 19
+HOT_TIER = "hot"
+ARCHIVE_TIER = "archive"
+
+
+def is_archived(path) -> bool:
+    return str(path).endswith(ARCHIVE_SUFFIX)
+
+
+def document_tier(document: dict) -> str:
+    return document.get("storage_tier", HOT_TIER)
+
+
+def open_blob(raw: BinaryIO) -> BinaryIO:
+    """Wrap an open stored file so reads return the original bytes"""
+    if is_archived(getattr(raw, "name", "")):
+        return zstandard.ZstdDecompressor().stream_reader(raw, read_size=CHUNK_SIZE)
+    return raw
+
+
+def read_blob(path) -> bytes:
+    """Original bytes of a stored blob, from either tier"""
+    with open(path, "rb") as f:
+        if is_archived(path):
+            return zstandard.ZstdDecompressor().decompressobj().decompress(f.read())
+        return f.read()
+
+
+def _hash_stream(stream: BinaryIO) -> str:
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def compress_blob(source: Path, destination: Path, expected_hash: str, level: int = DEFAULT_LEVEL) -> int:
+    """
+    Compress ``source`` into ``destination`` and return the compressed size.
+
+    The source is hashed while it is compressed and the written archive is
+    decompressed and hashed again before it is moved into place, so a blob is
+    only ever archived if both match ``expected_hash``.
+    """
+    tmp_path = destination.with_name(destination.name + ".tmp")
+    compressor = zstandard.ZstdCompressor(level=level, write_checksum=True)
+    sha256 = hashlib.sha256()
+    try:
+        with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+            # The source size lets zstd record the content size in the frame header
+            with compressor.stream_writer(dst, size=os.fstat(src.fileno()).st_size, closefd=False) as writer:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    sha256.update(chunk)
+                    writer.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+        if sha256.hexdigest() != expected_hash:
+            raise ValueError(f"{source} does not match its recorded hash")
+        with open(tmp_path, "rb") as f:
+            if _hash_stream(zstandard.ZstdDecompressor().stream_reader(f)) != expected_hash:
+                raise ValueError(f"Archive of {source} failed verification")
+        os.replace(tmp_path, destination)
+        return os.path.getsize(destination)
+    finally:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+
+
+class Tiering:
+    def __init__(self, store, resolve_path, archive_dir: Path):
+        self.store = store
+        self.resolve_path = resolve_path
+        self.archive_dir = Path(archive_dir)
+
+    def candidates(self, min_age_days: float) -> list:
+        """Hot-tier documents uploaded more than ``min_age_days`` ago"""
+        cutoff = datetime.now() - timedelta(days=min_age_days)
+        documents = []
+        for document in self.store.all_documents():
+            if document_tier(document) != HOT_TIER:
+                continue
+            if document["file_hash"].startswith(PLACEHOLDER_HASH_PREFIXES):
+                continue
+            try:
+                uploaded = datetime.fromisoformat(str(document["timestamp"]))
+            except ValueError:
+                continue
+            if uploaded.replace(tzinfo=None) <= cutoff:
+                documents.append(document)
+        return documents
+
+    def archive_document(self, document: dict, level: int = DEFAULT_LEVEL) -> Optional[dict]:
+        """Move one document to the archive tier; returns the updated record"""
+        source = self.resolve_path(document["file_path"])
+        original_bytes = os.path.getsize(source)
+        destination = self.archive_dir / (source.name + ARCHIVE_SUFFIX)
+        stored_bytes = compress_blob(source, destination, document["file_hash"], level)
+
+        updated = self.store.update(
+            document["id"],
+            file_path=str(destination),
+            storage_tier=ARCHIVE_TIER,
+            original_bytes=original_bytes,
+            stored_bytes=stored_bytes,
+            archived_at=datetime.now().isoformat(),
+        )
+        if updated is None:
+            # Record vanished while we were compressing; keep the original
+            os.remove(destination)
+            return None
+        # Readers now resolve the archive copy, so the original can go
+        os.remove(source)
+        return updated
+
+    def archive(self, min_age_days: float, level: int = DEFAULT_LEVEL, dry_run: bool = False) -> dict:
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        summary = {"archived": 0, "failed": 0, "original_bytes": 0, "stored_bytes": 0}
+        for document in self.candidates(min_age_days):
+            if dry_run:
+                print(f"Would archive {document['id']} ({document['file_path']})")
+                continue
+            try:
+                updated = self.archive_document(document, level)
+            except (OSError, ValueError) as e:
+                print(f"Skipping {document['id']}: {e}")
+                summary["failed"] += 1
+                continue
+            if updated is not None:
+                summary["archived"] += 1
+                summary["original_bytes"] += updated["original_bytes"]
+                summary["stored_bytes"] += updated["stored_bytes"]
+        return summary
+
+    def report(self, samples: int = 50) -> dict:
+        """Disk use per tier and cold read latency (page cache dropped) for a sample of each"""
+        tiers = {}
+        for document in self.store.all_documents():
+            try:
+                path = self.resolve_path(document["file_path"])
+                stored = os.path.getsize(path)
+            except (FileNotFoundError, OSError):
+                continue
+            tier = tiers.setdefault(
+                document_tier(document),
+                {"documents": 0, "original_bytes": 0, "stored_bytes": 0, "paths": []}
+            )
+            tier["documents"] += 1
+            tier["stored_bytes"] += stored
+            tier["original_bytes"] += document.get("original_bytes", stored)
+            if len(tier["paths"]) < samples:
+                tier["paths"].append(path)
+
+        for tier in tiers.values():
+            timings = []
+            for path in tier.pop("paths"):
+                _drop_page_cache(path)
+                start = time.perf_counter()
+                read_blob(path)
+                timings.append((time.perf_counter() - start) * 1000)
+            tier["saved_bytes"] = tier["original_bytes"] - tier["stored_bytes"]
+            tier["read_ms_p50"] = round(statistics.median(timings), 3) if timings else None
+            tier["read_ms_p95"] = round(_percentile(timings, 0.95), 3) if timings else None
+        return tiers
+
+
+def _drop_page_cache(path: Path) -> None:
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move aged uploads to the compressed archive tier")
+    parser.add_argument("command", choices=["archive", "report"])
+    parser.add_argument("--min-age-days", type=float, default=float(os.getenv("ARCHIVE_MIN_AGE_DAYS", "90")))
+    parser.add_argument("--level", type=int, default=DEFAULT_LEVEL, help="zstd compression level")
+    parser.add_argument("--dry-run", action="store_true", help="list documents that would be archived")
+    parser.add_argument("--samples", type=int, default=50, help="documents per tier to time reads for")
+    args = parser.parse_args()
+
+    from config import ARCHIVE_DIR, open_document_store, resolve_upload_path
+
+    tiering = Tiering(open_document_store(), resolve_upload_path, ARCHIVE_DIR)
+    if args.command == "archive":
+        summary = tiering.archive(args.min_age_days, args.level, args.dry_run)
+        saved = summary["original_bytes"] - summary["stored_bytes"]
+        print(f"Archived {summary['archived']} documents ({summary['failed']} failed), saved {saved} bytes")
+    else:
+        for name, tier in tiering.report(args.samples).items():
+            print(
+                f"{name}: {tier['documents']} documents, {tier['stored_bytes']} bytes on disk "
+                f"({tier['saved_bytes']} saved), read p50 {tier['read_ms_p50']} ms, p95 {tier['read_ms_p95']} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
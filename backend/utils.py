@@ -1,6 +1,7 @@
-from passlib.context import CryptContext
+from passwords import password_service
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Shared with main and the CLIs so there is a single hashing policy
+pwd_context = password_service.context
 
 def hash_password(password_hash: str) -> str:
     return pwd_context.hash(password_hash)
\ No newline at end of file
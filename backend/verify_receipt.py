@@ -0,0 +1,141 @@
+"""
+Offline checking of signed verification receipts.
+
+Checks a receipt's signature against the issuer's public keys (the JWK Set
+from ``/receipts/keys``, fetched once and kept locally) and the local file's
+SHA-256 against the one in the receipt. Nothing here talks to the backend.
+
+A receipt records the document's status when it was signed and expires a
+day (by default) later, so a stamp revoked since then is only caught once
+the receipt expires: fetch a fresh receipt when that window matters.
+
+    python verify_receipt.py --jwks keys.json receipt.jws invoice.pdf [receipt2.jws invoice2.pdf ...]
+
+Exits non-zero if any receipt fails.
+"""
+import argparse
+import hashlib
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
+
+from jose import jwk, jws
+from jose.exceptions import JOSEError
+
+ALGORITHM = "ES256"
+RECEIPT_TYPE = "eureka-receipt+jws"
+# Statuses for which the stamp no longer vouches for the document
+REVOKED_STATUSES = ("revoked",)
+
+CHUNK_SIZE = 1024 * 1024
+# Allowed clock difference (seconds) between issuer and verifier
+LEEWAY = 60
+
+
+class ReceiptError(Exception):
+    pass
+
+
+class ReceiptVerifier:
+    """
+    Verifies receipts against a JWK Set. Key objects are built once per key
+    ID, so checking a batch pays only for the signature checks themselves.
+    """
+
+    def __init__(self, jwks: dict):
+        self._keys = {}
+        for entry in jwks.get("keys", []):
+            if entry.get("kty") == "EC" and entry.get("kid"):
+                self._keys[entry["kid"]] = jwk.construct(entry, ALGORITHM)
+
+    @classmethod
+    def from_file(cls, path: Union[str, Path]) -> "ReceiptVerifier":
+        return cls(json.loads(Path(path).read_text()))
+
+    def claims(self, token: str) -> dict:
+        """Signed claims of a receipt; raises ReceiptError if the signature doesn't check out"""
+        token = token.strip()
+        try:
+            header = jws.get_unverified_header(token)
+        except JOSEError as e:
+            raise ReceiptError(f"Malformed receipt: {e}")
+        if header.get("alg") != ALGORITHM or header.get("typ") != RECEIPT_TYPE:
+            raise ReceiptError("Not a verification receipt")
+        key = self._keys.get(header.get("kid"))
+        if key is None:
+            raise ReceiptError(f"Unknown signing key {header.get('kid')!r}")
+        try:
+            payload = jws.verify(token, key, algorithms=[ALGORITHM])
+        except JOSEError as e:
+            raise ReceiptError(f"Invalid signature: {e}")
+        return json.loads(payload)
+
+    def verify(
+        self, token: str, file: Optional[Union[str, Path]] = None, allow_revoked: bool = False,
+        now: Optional[float] = None,
+    ) -> dict:
+        """
+        Check a receipt is signed and unexpired and, if given, that ``file``
+        is the document it was issued for. Returns the receipt's claims.
+        """
+        claims = self.claims(token)
+        expires = claims.get("exp")
+        if not isinstance(expires, (int, float)):
+            raise ReceiptError("Receipt has no expiry")
+        if (time.time() if now is None else now) > expires + LEEWAY:
+            raise ReceiptError(f"Receipt for {claims.get('sub')} expired; fetch a fresh one")
+        if claims.get("status") in REVOKED_STATUSES and not allow_revoked:
+            raise ReceiptError(f"Document {claims.get('sub')} was {claims['status']}")
+        if file is not None:
+            digest = file_sha256(file)
+            if digest != claims.get("sha256"):
+                raise ReceiptError(f"File does not match document {claims.get('sub')}")
+        return claims
+
+    def verify_many(self, items: Iterable[Tuple[str, Optional[Union[str, Path]]]]) -> List[Tuple[Optional[dict], Optional[str]]]:
+        """(claims, None) or (None, error) per (token, file) pair"""
+        results = []
+        for token, file in items:
+            try:
+                results.append((self.verify(token, file), None))
+            except (ReceiptError, OSError) as e:
+                results.append((None, str(e)))
+        return results
+
+
+def file_sha256(path: Union[str, Path]) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check verification receipts against local files, offline")
+    parser.add_argument("--jwks", type=Path, required=True, help="issuer public keys, as served by /receipts/keys")
+    parser.add_argument("--allow-revoked", action="store_true", help="accept receipts for revoked documents")
+    parser.add_argument("pairs", nargs="+", help="receipt file followed by the document file, repeated")
+    args = parser.parse_args()
+    if len(args.pairs) % 2:
+        parser.error("expected receipt/file pairs")
+
+    verifier = ReceiptVerifier.from_file(args.jwks)
+    failed = 0
+    for receipt_path, file in zip(args.pairs[::2], args.pairs[1::2]):
+        try:
+            claims = verifier.verify(Path(receipt_path).read_text(), file, allow_revoked=args.allow_revoked)
+        except (ReceiptError, OSError) as e:
+            failed += 1
+            print(f"FAIL {file}: {e}")
+            continue
+        anchor = claims.get("anchor", {})
+        anchored = f" tx={anchor['tx_hash']}" if anchor.get("tx_hash") else ""
+        print(f"OK   {file}: {claims['sub']} stamped {claims['ts']} status={claims['status']}{anchored}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()